@@ -1,30 +1,24 @@
+import os
+import sys
+import numpy as np
+
+# In the QGIS Python console __file__ is not defined, the Scripts folder then has to be the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd())
+from gridAttributes import cellCenters, setAttributes
+
 project = QgsProject.instance()
 grid = project.mapLayersByName('LYB')[0]
 
-# Start editing the grid layer
-grid.startEditing()
+# Calculate the long and lat values of all cells at once
+fids, lon, lat = cellCenters(grid)
 
-# Add longitude, latitude, and layer name fields
-grid.dataProvider().addAttributes([
+# Add the id, longitude, latitude, and layer name fields and set their values in one batch
+setAttributes(grid, [
     QgsField('id', QVariant.Int),
     QgsField('Lon', QVariant.Double),
     QgsField('Lat', QVariant.Double),
     QgsField('adm_0', QVariant.String)
-])
-grid.updateFields()
-
-# Iterate through and set the long, lat, and layer name values
-for i, feature in enumerate(grid.getFeatures(), start=1):
-    geom = feature.geometry()
-    centroid = geom.centroid().asPoint()
-    feature['Lon'] = centroid.x()
-    feature['Lat'] = centroid.y()
-    feature['adm_0'] = grid.name()
-    feature['id'] = i
-    grid.updateFeature(feature)
-
-# Commit changes
-grid.commitChanges()
+], fids, [np.arange(1, len(fids) + 1), lon, lat, [grid.name()] * len(fids)])
 
 # Add the grid layer to the project
 QgsProject.instance().addMapLayer(grid)
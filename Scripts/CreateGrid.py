@@ -1,4 +1,6 @@
 import os
+import sys
+import numpy as np
 from osgeo import gdal
 from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsVectorLayer, QgsField, QgsVectorFileWriter
 import processing
@@ -6,23 +8,17 @@ import pandas as pd
 import csv
 from PyQt5.QtCore import QVariant
 
+# In the QGIS Python console __file__ is not defined, the Scripts folder then has to be the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd())
+from regularGrid import RegularGrid
+
 def createGrid(raster_layer):
     ext = raster_layer.extent()
     
-    # Create the grid
-    result = processing.run("native:creategrid", {
-        'TYPE': 2,
-        'EXTENT': ext,
-        'HSPACING': 0.25,
-        'VSPACING': 0.25,
-        'HOVERLAY': 0,
-        'VOVERLAY': 0,
-        'CRS': QgsCoordinateReferenceSystem('EPSG:4326'),
-        'OUTPUT': 'TEMPORARY_OUTPUT'
-    })
-    
-    # Extract the grid layer directly
-    grid = result['OUTPUT']
+    # Create the grid aligned to the raster pixels
+    grid_spec = RegularGrid.fromExtent(ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum(), 0.25,
+                                       align_to=gdal.Open(raster_layer.source()).GetGeoTransform())
+    grid = grid_spec.toLayer(np.arange(grid_spec.cellCount()), 'EPSG:4326', 'Grid')
         
     # Add the grid layer to the project
     QgsProject.instance().addMapLayer(grid)
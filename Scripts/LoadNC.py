@@ -1,24 +1,56 @@
 import os
+import sys
 from qgis.core import QgsProject, QgsRasterLayer
 
+# In the QGIS Python console __file__ is not defined, the Scripts folder then has to be the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd())
+from rasterCatalog import scanDirectory, layerName
+
 # Set the directory containing the .nc files
 directory = f"C:/Users/nikolaus/Documents/KfW Project/Data/01_PreData/Sea Leve Raise data/ESA Sea Level Climate Change Initiative (Sea_Level_cci) Time series of gridded Sea Level Anomalies (SLA), Version 2.0/2015"
 
-# Get a list of all .nc files in the directory
-nc_files = [f for f in os.listdir(directory) if f.endswith('.nc')]
-
-# Loop through the files in reverse order
-for filename in reversed(nc_files):
-    filepath = os.path.join(directory, filename)
-    
-    # Create a raster layer
-    raster_layer = QgsRasterLayer(filepath, filename)
-    
-    # Check if the layer is valid
-    if raster_layer.isValid():
-        # Add the raster layer to the project
-        QgsProject.instance().addMapLayer(raster_layer)
-    else:
-        print(f"Failed to load {filename}")
 
+def loadLayers(catalog, names=None):
+    """
+    Adds the rasters of catalog entries to the project as layers, in reverse order.
+
+    Only the requested entries are opened as layers and all of them are added in one call.
+
+    Parameters:
+    -----------
+    catalog : list of dict
+        The catalog entries, see rasterCatalog.scanDirectory.
+    names : list of str, optional
+        The layer names to load, by default all entries.
+
+    Returns:
+    --------
+    list of QgsRasterLayer
+        The loaded layers.
+    """
+    layers = []
+    for entry in reversed(catalog):
+        name = layerName(entry)
+        if names is not None and name not in names:
+            continue
+        # Create a raster layer
+        raster_layer = QgsRasterLayer(entry['source'], name)
+
+        # Check if the layer is valid
+        if raster_layer.isValid():
+            layers.append(raster_layer)
+        else:
+            print(f"Failed to load {name}")
+    QgsProject.instance().addMapLayers(layers)
+    return layers
+
+
+# Example usage
+# Only the headers of the .nc files are read, in worker processes for large directories
+catalog = scanDirectory(directory, '*.nc')
+for entry in catalog:
+    print(f"{layerName(entry)}: {entry['bands']} bands, {entry['time_start']} to {entry['time_end']}")
+
+# Layers are only created for the rasters which are needed, e.g. loadLayers(catalog, ['<file>.nc'])
+loadLayers(catalog)
 print("All valid raster layers have been loaded in reverse order.")
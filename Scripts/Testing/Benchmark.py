@@ -0,0 +1,510 @@
+# Description: Benchmark of the stages of the zonal pipeline on synthetic data. A multi-band raster and
+# star shaped country masks of configurable size are generated locally, then grid creation, extraction,
+# zonal statistics, CSV combination, dissolve and clip are timed separately with their throughput and
+# peak memory. Runs offline with GDAL, NumPy and pandas. Grid creation and extraction make the calls of
+# ProcessingTool.createGrid and extractGrid, the QGIS layers are only created if QGIS is available.
+#
+# Usage (from the Scripts folder):
+#     python Testing/Benchmark.py --width 1440 --height 720 --bands 12 --countries 8 --json benchmark.json
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from regularGrid import RegularGrid
+from maskSimplify import MaskCache, toleranceForSpacing
+from zonalEngine import ZonalEngine
+from csvCombine import CSVCombiner
+from dissolveEngine import dissolveAll
+from clipEngine import ClipEngine
+from stageMetrics import resetPeakMemory, peakMemory
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Resolution of the synthetic raster and spacing of the grid in degrees, like the sea level data
+RESOLUTION = 0.25
+GRID_SPACING = 0.232
+
+
+def createRaster(path, width, height, bands, seed=0):
+    """
+    Creates a synthetic multi-band raster in EPSG:4326 with random values and some nodata pixels.
+
+    If GDAL has the netCDF driver and netCDF4 is installed, a CF NetCDF file like the CORDEX data is
+    written, with one variable of the dimensions (time, lat, lon), and its variable is opened as
+    subdataset. Otherwise a GeoTIFF with one band per time step is written.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the raster without extension.
+    width, height : int
+        The size of the raster in pixels.
+    bands : int
+        The number of bands.
+    seed : int
+        The seed of the random values.
+
+    Returns:
+    --------
+    str
+        The GDAL readable path of the raster, NETCDF:"<file>":values for a NetCDF file.
+    """
+    random = np.random.default_rng(seed)
+
+    def bandValues(band):
+        values = random.normal(band, 1.0, (height, width)).astype(np.float32)
+        values[random.random((height, width)) < 0.01] = -9999
+        return values
+
+    try:
+        import netCDF4
+    except ImportError:
+        netCDF4 = None
+    if netCDF4 is not None and gdal.GetDriverByName('netCDF'):
+        # GDAL writes every band of a multi-band dataset as its own 2-D variable, so the file is
+        # written with netCDF4 to get a single 3-D variable whose time steps GDAL reads as bands
+        path += '.nc'
+        with netCDF4.Dataset(path, 'w') as dataset:
+            dataset.Conventions = 'CF-1.6'
+            dataset.createDimension('time', None)
+            dataset.createDimension('lat', height)
+            dataset.createDimension('lon', width)
+            time_variable = dataset.createVariable('time', 'f8', ('time',))
+            time_variable.units = 'days since 2000-01-01 00:00:00'
+            time_variable.calendar = 'standard'
+            time_variable.standard_name = 'time'
+            lat = dataset.createVariable('lat', 'f8', ('lat',))
+            lat.units = 'degrees_north'
+            lat.standard_name = 'latitude'
+            lat[:] = 90 - (np.arange(height) + 0.5) * RESOLUTION
+            lon = dataset.createVariable('lon', 'f8', ('lon',))
+            lon.units = 'degrees_east'
+            lon.standard_name = 'longitude'
+            lon[:] = -180 + (np.arange(width) + 0.5) * RESOLUTION
+            crs = dataset.createVariable('crs', 'i4')
+            crs.grid_mapping_name = 'latitude_longitude'
+            crs.semi_major_axis = 6378137.0
+            crs.inverse_flattening = 298.257223563
+            values = dataset.createVariable('values', 'f4', ('time', 'lat', 'lon'), zlib=True,
+                                            chunksizes=(1, height, width), fill_value=np.float32(-9999))
+            values.grid_mapping = 'crs'
+            values.set_auto_mask(False)
+            for band in range(bands):
+                time_variable[band] = band * 30.0
+                values[band] = bandValues(band + 1)
+        return f'NETCDF:"{path}":values'
+
+    path += '.tif'
+    dataset = gdal.GetDriverByName('GTiff').Create(path, width, height, bands, gdal.GDT_Float32,
+                                                   options=['TILED=YES', 'INTERLEAVE=BAND'])
+    dataset.SetGeoTransform((-180, RESOLUTION, 0, 90, 0, -RESOLUTION))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    dataset.SetProjection(srs.ExportToWkt())
+    for band in range(1, bands + 1):
+        raster_band = dataset.GetRasterBand(band)
+        raster_band.SetNoDataValue(-9999)
+        raster_band.WriteArray(bandValues(band))
+    dataset = None
+    return path
+
+
+def startQgis():
+    """
+    Starts a standalone QgsApplication if QGIS is installed, see batchRunner.initWorker.
+
+    Returns:
+    --------
+    QgsApplication or None
+        The application, it has to stay referenced while the benchmark runs. None without QGIS.
+    """
+    try:
+        from qgis.core import QgsApplication
+    except ImportError:
+        return None
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    return qgs
+
+
+def createMasks(folder, countries, vertices, parts, extent, seed=0):
+    """
+    Creates star shaped country masks, each split into wedge features which share their edges.
+
+    Parameters:
+    -----------
+    folder : str
+        The folder of the shapefiles.
+    countries : int
+        The number of countries.
+    vertices : int
+        The number of boundary vertices of every country.
+    parts : int
+        The number of features every country is split into.
+    extent : tuple of float
+        The x_min, y_min, x_max and y_max the countries are placed in.
+    seed : int
+        The seed of the random shapes.
+
+    Returns:
+    --------
+    dict
+        The country names and the paths of their shapefiles.
+    """
+    random = np.random.default_rng(seed)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    columns = math.ceil(math.sqrt(countries))
+    rows = math.ceil(countries / columns)
+    cell_width = (extent[2] - extent[0]) / columns
+    cell_height = (extent[3] - extent[1]) / rows
+
+    paths = {}
+    for index in range(countries):
+        name = f'C{index:03d}'
+        center_x = extent[0] + (index % columns + 0.5) * cell_width
+        center_y = extent[3] - (index // columns + 0.5) * cell_height
+        radius = 0.45 * min(cell_width, cell_height)
+        angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+        radii = radius * (0.6 + 0.4 * random.random(vertices))
+        boundary = list(zip(center_x + radii * np.cos(angles), center_y + radii * np.sin(angles)))
+
+        path = os.path.join(folder, f'{name}.shp')
+        source = driver.CreateDataSource(path)
+        layer = source.CreateLayer(name, srs, ogr.wkbPolygon)
+        for part in range(parts):
+            start = part * vertices // parts
+            end = (part + 1) * vertices // parts
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            ring.AddPoint_2D(center_x, center_y)
+            for x, y in boundary[start:end + 1] if end < vertices else boundary[start:] + boundary[:1]:
+                ring.AddPoint_2D(x, y)
+            ring.AddPoint_2D(center_x, center_y)
+            polygon = ogr.Geometry(ogr.wkbPolygon)
+            polygon.AddGeometry(ring)
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(polygon)
+            layer.CreateFeature(feature)
+        source = None
+        paths[name] = path
+    return paths
+
+
+def readGeometries(path):
+    """
+    Reads the geometries of a shapefile as WKB.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the shapefile.
+
+    Returns:
+    --------
+    list of bytes
+        The geometries.
+    """
+    source = ogr.Open(path)
+    return [bytes(feature.GetGeometryRef().ExportToWkb()) for feature in source.GetLayer(0)]
+
+
+def cellPolygons(grid, indices):
+    """
+    Returns the cell geometries of a grid as WKT.
+
+    Parameters:
+    -----------
+    grid : RegularGrid
+        The grid.
+    indices : numpy.ndarray
+        The cell indices.
+
+    Returns:
+    --------
+    list of str
+        The cell polygons.
+    """
+    left, top, right, bottom = grid.cellBounds(indices)
+    return [f'POLYGON(({l} {t},{r} {t},{r} {b},{l} {b},{l} {t}))'
+            for l, t, r, b in zip(left.tolist(), top.tolist(), right.tolist(), bottom.tolist())]
+
+
+def rasterPixels(path):
+    """
+    Returns the number of pixels of all bands of a raster.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the raster.
+
+    Returns:
+    --------
+    int
+        The width times height times band count.
+    """
+    dataset = gdal.Open(path)
+    return dataset.RasterXSize * dataset.RasterYSize * dataset.RasterCount
+
+
+def measure(stage, function, units, unit_name, trace_memory=False):
+    """
+    Runs a stage and measures its wall time, CPU time and peak memory.
+
+    The peak of the NumPy and Python allocations is only traced on request, as tracing slows down
+    the stages. The peak resident memory is reset before the stage where the platform allows it,
+    see stageMetrics, otherwise peak_rss_scope is 'process'. Stages running in worker processes,
+    e.g. the dissolve, also report the CPU time and the largest peak memory of the workers which
+    finished during the stage.
+
+    Parameters:
+    -----------
+    stage : str
+        The name of the stage.
+    function : callable
+        The stage, called without arguments.
+    units : callable
+        Returns the number of processed units from the result of the stage.
+    unit_name : str
+        The name of the units, e.g. 'cells'.
+    trace_memory : bool
+        Whether the peak of the Python allocations is traced.
+
+    Returns:
+    --------
+    tuple
+        The result of the stage and the measurement as dict.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    peak_reset = resetPeakMemory()
+    peak_before = None if peak_reset else peakMemory()
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss if resource else None
+    children_cpu = os.times()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = function()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    children_cpu = sum(os.times()[2:4]) - sum(children_cpu[2:4])
+    peak = peakMemory()
+    # The children maximum is kept over all finished workers, it only belongs to the stage if it grew
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss if resource else None
+    children_peak = children_peak / (1024 ** 2 if sys.platform == 'darwin' else 1024) if children_peak is not None and children_peak > children_before else None
+    python_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    count = units(result)
+    measurement = {
+        'stage': stage,
+        'seconds': round(wall, 4),
+        'cpu_seconds': round(cpu, 4),
+        unit_name: count,
+        f'{unit_name}_per_second': round(count / wall, 1) if wall > 0 else None,
+        'python_peak_mb': round(python_peak / 1024 ** 2, 1) if trace_memory else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'peak_rss_scope': 'stage' if peak_reset or (peak is not None and peak_before is not None and peak > peak_before) else 'process',
+        'children_cpu_seconds': round(children_cpu, 4),
+        'children_peak_rss_mb': round(children_peak, 1) if children_peak is not None else None,
+    }
+    print(f"{stage:<18} {wall:8.3f} s  {measurement[f'{unit_name}_per_second'] or 0:>14,.0f} {unit_name}/s"
+          f"  peak RSS {measurement['peak_rss_mb']} MB ({measurement['peak_rss_scope']}),"
+          f" workers {measurement['children_peak_rss_mb']} MB, Python peak {measurement['python_peak_mb']} MB")
+    return result, measurement
+
+
+def runBenchmark(folder, width, height, bands, countries, vertices, parts, workers=None, trace_memory=False, qgs=None):
+    """
+    Generates the synthetic data in a folder and times every stage.
+
+    Parameters:
+    -----------
+    folder : str
+        The working folder.
+    width, height : int
+        The size of the raster in pixels.
+    bands : int
+        The number of raster bands.
+    countries : int
+        The number of country masks.
+    vertices : int
+        The number of boundary vertices of every country.
+    parts : int
+        The number of features every country is split into.
+    workers : int, optional
+        The number of workers of dissolve and clip, by default the number of CPUs.
+    trace_memory : bool
+        Whether the peak of the Python allocations is traced, see measure.
+    qgs : QgsApplication, optional
+        The running QgsApplication, see startQgis. Without it the grid layers are not created and
+        the extraction is skipped.
+
+    Returns:
+    --------
+    list of dict
+        The measurements of all stages.
+    """
+    raster_path = createRaster(os.path.join(folder, 'raster'), width, height, bands)
+    # The stages read the time steps as bands, a raster without them would measure nothing
+    band_count = gdal.Open(raster_path).RasterCount
+    if band_count != bands:
+        raise ValueError(f"Raster {raster_path} has {band_count} bands instead of {bands}")
+    extent = (-180, 90 - height * RESOLUTION, -180 + width * RESOLUTION, 90)
+    mask_folder = os.path.join(folder, 'masks')
+    os.makedirs(mask_folder, exist_ok=True)
+    masks = createMasks(mask_folder, countries, vertices, parts, extent)
+    geotransform = gdal.Open(raster_path).GetGeoTransform()
+    geometries = {name: readGeometries(path) for name, path in masks.items()}
+    print(f"Raster {width}x{height} with {bands} bands, {countries} countries with {vertices} vertices in {parts} parts")
+
+    measurements = []
+
+    def timed(stage, function, units, unit_name):
+        return measure(stage, function, units, unit_name, trace_memory)
+
+    # The masks are simplified and cached like the default of ProcessingTool
+    tolerance = toleranceForSpacing(GRID_SPACING)
+    mask_cache = MaskCache(os.path.join(folder, 'mask_cache'))
+    if qgs is not None:
+        from qgis.core import QgsVectorLayer, QgsField
+        from PyQt5.QtCore import QVariant
+        from countryMask import CountryMask
+        country_layers = {name: QgsVectorLayer(path, name, 'ogr') for name, path in masks.items()}
+
+    def createGrids():
+        # The calls of ProcessingTool.createGrid for every country
+        grids = {}
+        for name, wkbs in geometries.items():
+            if qgs is not None:
+                mask_geometries = CountryMask(country_layers[name], tolerance, mask_cache).geometries()
+                ext = country_layers[name].extent()
+                x_min, y_min, x_max, y_max = ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()
+            else:
+                mask_geometries = mask_cache.simplified(name, wkbs, tolerance)
+                x_min, x_max, y_min, y_max = ogr.CreateGeometryFromWkb(wkbs[0]).GetEnvelope()
+                for wkb in wkbs[1:]:
+                    envelope = ogr.CreateGeometryFromWkb(wkb).GetEnvelope()
+                    x_min, x_max = min(x_min, envelope[0]), max(x_max, envelope[1])
+                    y_min, y_max = min(y_min, envelope[2]), max(y_max, envelope[3])
+            grid = RegularGrid.fromExtent(x_min, y_min, x_max, y_max, GRID_SPACING, align_to=geotransform)
+            cells = grid.maskedCells(mask_geometries)
+            left, top, right, bottom = grid.cellBounds(cells)
+            layer = None
+            if qgs is not None:
+                layer = grid.toLayer(cells, 'EPSG:4326', 'Grid', [
+                    QgsField('longitude', QVariant.Double),
+                    QgsField('latitude', QVariant.Double),
+                    QgsField('layer_name', QVariant.String)
+                ], [(left + right) / 2, (top + bottom) / 2, [name] * len(cells)])
+            grids[name] = (grid, cells, layer)
+        return grids
+    grids, measurement = timed('grid', createGrids, lambda grids: sum(len(cells) for _, cells, _ in grids.values()), 'cells')
+    measurements.append(measurement)
+
+    if qgs is not None:
+        # The calls of ProcessingTool.extractGrid, the country mask is built again from the mask cache
+        extracted, measurement = timed(
+            'extract', lambda: {name: CountryMask(country_layers[name], tolerance, mask_cache).extract(layer, 'Extracted')
+                                for name, (_, _, layer) in grids.items()},
+            lambda extracted: sum(layer.featureCount() for layer in extracted.values()), 'cells')
+        measurements.append(measurement)
+    else:
+        print("extract            skipped, CountryMask.extract needs QGIS")
+    cells = {name: indices for name, (_, indices, _) in grids.items()}
+    grids = {name: grid for name, (grid, _, _) in grids.items()}
+    polygons = {name: cellPolygons(grids[name], indices) for name, indices in cells.items()}
+
+    results = {}
+    for mode in ('center', 'coverage'):
+        def zonalStatistics():
+            engines = {name: ZonalEngine(raster_path, cell_polygons, mode=mode) for name, cell_polygons in polygons.items()}
+            return engines, {name: engine.compute() for name, engine in engines.items()}
+        (engines, results[mode]), measurement = timed(
+            f'zonal_{mode}', zonalStatistics,
+            lambda result: sum(len(engine.pixels) * engine.band_count for engine in result[0].values()), 'pixels')
+        measurements.append(measurement)
+
+    # One individual CSV per country and band, like CutSeaLevelRaise writes one per raster
+    csv_folder = os.path.join(folder, 'individual_csv')
+    os.makedirs(csv_folder, exist_ok=True)
+    for name, stats in results['center'].items():
+        left, top, right, bottom = grids[name].cellBounds(cells[name])
+        for band in range(bands):
+            with open(os.path.join(csv_folder, f'{name}_{band:03d}.csv'), 'w') as outfile:
+                outfile.write(f'adm_0,Lat,Lon,band{band + 1:03d}_mean\n')
+                for lat, lon, mean in zip(((top + bottom) / 2).tolist(), ((left + right) / 2).tolist(), stats['mean'][band].tolist()):
+                    outfile.write(f'{name},{lat},{lon},{"" if math.isnan(mean) else mean}\n')
+    combined, measurement = timed('csv_combine', lambda: CSVCombiner(csv_folder).update(),
+                                  lambda combined: combined.size, 'values')
+    measurements.append(measurement)
+
+    dissolved, measurement = timed('dissolve', lambda: dissolveAll(masks, workers),
+                                   lambda dissolved: countries * vertices, 'vertices')
+    measurements.append(measurement)
+
+    clip_folder = os.path.join(folder, 'clipped')
+    clipped, measurement = timed('clip', lambda: ClipEngine(raster_path, 'GTiff', workers).clipAll(masks, clip_folder),
+                                 lambda clipped: sum(rasterPixels(path) for path in clipped.values() if path), 'pixels')
+    measurements.append(measurement)
+    return measurements
+
+
+def main(argv=None):
+    """
+    Runs the benchmark with the sizes given on the command line.
+
+    Parameters:
+    -----------
+    argv : list of str, optional
+        The arguments, by default sys.argv.
+
+    Returns:
+    --------
+    int
+        The exit code.
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks the zonal pipeline stages on synthetic data.')
+    parser.add_argument('--width', type=int, default=1440, help='raster width in pixels of 0.25 degrees')
+    parser.add_argument('--height', type=int, default=720, help='raster height in pixels')
+    parser.add_argument('--bands', type=int, default=12, help='number of raster bands')
+    parser.add_argument('--countries', type=int, default=8, help='number of country masks')
+    parser.add_argument('--vertices', type=int, default=2000, help='boundary vertices per country')
+    parser.add_argument('--parts', type=int, default=16, help='features per country, merged by the dissolve')
+    parser.add_argument('--workers', type=int, help='workers of dissolve and clip, by default the number of CPUs')
+    parser.add_argument('--trace-memory', action='store_true', help='trace the peak of the NumPy allocations (slower)')
+    parser.add_argument('--folder', help='keep the generated data in this folder instead of a temporary one')
+    parser.add_argument('--json', help='write the measurements to this JSON file')
+    args = parser.parse_args(argv)
+
+    gdal.UseExceptions()
+    qgs = startQgis()
+    with tempfile.TemporaryDirectory() as temp_folder:
+        folder = args.folder or temp_folder
+        os.makedirs(folder, exist_ok=True)
+        measurements = runBenchmark(folder, args.width, args.height, args.bands, args.countries,
+                                    args.vertices, args.parts, args.workers, args.trace_memory, qgs)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump({'parameters': dict(vars(args), qgis=qgs is not None), 'stages': measurements}, outfile, indent=2)
+        print(f"Measurements saved at {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,12 @@
 # Description: This script iterates through shapefiles in a specified group within a QGIS project, clips a raster layer using each shapefile,  and saves the output to a specified directory.
 
 import os
+import sys
+
+# In the QGIS Python console __file__ is not defined, the Scripts folder then has to be the working directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) if '__file__' in globals() else os.getcwd())
+from clipEngine import ClipEngine
+
 ### Script running though shapefiles and cliiping raster based on the current shp
 # Getting active project
 project = QgsProject.instance()
@@ -20,62 +26,46 @@ raster_layer = QgsProject.instance().mapLayersByName(layer_name)[0]
 # folder path, a specific folder will be created here in the function for each layer
 folder_path = f"C:/Users/nikolaus/Desktop/Script_testing/ClipCountry/"
 
-def clipCountry(group_name, group_layer, layer_name, raster_layer, fp):
+def clipCountry(group_name, group_layer, layer_name, raster_layer, fp, output_format='netCDF', workers=None, simplify=True):
     """
     Iterates through the layers in the specified group, clips a raster layer using each shapefile, and saves the output.
 
+    The raster is clipped by all shapefiles in parallel threads, or processes for NetCDF, see clipEngine.ClipEngine.
+
     Parameters:
     group_name (str): The name of the group containing the shapefiles.
     group_layer (QgsLayerTreeGroup): The group layer object containing the shapefiles.
     layer_name (str): The name of the raster layer to be clipped.
     raster_layer (QgsRasterLayer): The raster layer object to be clipped.
+    fp (str): The folder where a folder is created for each clipped country.
+    output_format (str): The output format, 'GTiff', 'COG', 'netCDF' or 'VRT'. A VRT only references the
+        source raster and can be written as pixels later with clipEngine.materialize.
+    workers (int): The number of worker threads or processes, by default the number of CPUs.
+    simplify (bool): Whether the masks are simplified with a tenth of the pixel size before clipping.
 
     Returns:
     None
     """
     
-    # iterating through the group layers
+    # collecting the shapefiles of the group layers
+    masks = {}
     for layer in group_layer.children():
         if isinstance(layer, QgsLayerTreeLayer) and layer.layer().type() == QgsMapLayer.VectorLayer:
-            # Get the shapefile layer
+            # Get the shapefile layer and its file path, layers in memory (e.g. from ShpDissolve) are passed as geometry
             shapefile_layer = layer.layer()
-            
-            shapefile_layer_name = str(shapefile_layer)
-            
-            start = shapefile_layer_name.find(": <QgsVectorLayer: '") + len(": <QgsVectorLayer:'")
-            end = shapefile_layer_name.find("' (ogr)>")
-            extracted_string_country = shapefile_layer_name[start:end]
-            
-            print(extracted_string_country)
-            
-            # Define the output path for the clipped raster
-            folder_path = f"{fp}/{extracted_string_country}"
-            
-            
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
-                print(f"Directory {folder_path} was created.")
-            
-            
-            output_path = f"C:/Users/nikolaus/Desktop/Script_testing/ClipCountry/{extracted_string_country}/test.nc"
+            if shapefile_layer.providerType() == 'ogr':
+                masks[shapefile_layer.name()] = shapefile_layer.source().split('|')[0]
+            else:
+                geometry = QgsGeometry.unaryUnion([feature.geometry() for feature in shapefile_layer.getFeatures()])
+                masks[shapefile_layer.name()] = (bytes(geometry.asWkb()), shapefile_layer.crs().toWkt())
+            print(shapefile_layer.name())
+
+    # Clip the raster using all shapefile layers
+    outputs = ClipEngine(raster_layer.source(), output_format, workers, simplify).clipAll(masks, fp)
 
-            # Clip the raster using the shapefile layer
-            processing.run("gdal:cliprasterbymasklayer", {
-                'INPUT': raster_layer,
-                'MASK': shapefile_layer,
-                'SOURCE_CRS': raster_layer.crs(),
-                'TARGET_CRS': raster_layer.crs(),
-                'NODATA': None,
-                'ALPHA_BAND': False,
-                'CROP_TO_CUTLINE': True,
-                'KEEP_RESOLUTION': True,
-                'OPTIONS': '',
-                'DATA_TYPE': 0,
-                'OUTPUT': output_path
-            })
-            
-            # confirmation that the shape as saved
-            print(f"Raster clipped for {shapefile_layer.name()}. Output saved as {output_path}")
+    for country, output_path in outputs.items():
+        # confirmation that the shape as saved
+        print(f"Raster clipped for {country}. Output saved as {output_path}")
  
  
 clipCountry(group_name, group_layer, layer_name, raster_layer, folder_path)
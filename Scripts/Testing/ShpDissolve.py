@@ -3,6 +3,11 @@
 # Description: This script iterates through shapefiles in a specified group within a QGIS project, dissolves each shapefile, and saves the output to a specified directory.
 
 import os
+import sys
+
+# In the QGIS Python console __file__ is not defined, the Scripts folder then has to be the working directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) if '__file__' in globals() else os.getcwd())
+from dissolveEngine import dissolveAll, saveGeometry
 
 # Getting active project
 project = QgsProject.instance()
@@ -13,72 +18,69 @@ group_name = "Countries"
 group_layer = project.layerTreeRoot().findGroup(group_name)
 
 
-def dissolveLoop(group_name, group_layer):
-    """Iterates through the layers in the specified group, dissolves each shapefile, and saves the output.
+def dissolveLoop(group_name, group_layer, save_folder=None, workers=None):
+    """Iterates through the layers in the specified group, dissolves each shapefile, and adds the result to the project.
+
+    The shapefiles are dissolved in parallel processes, see dissolveEngine.dissolveAll. The dissolved
+    layers are created in memory, they are only saved as shapefiles if a folder is given.
 
     Parameters
     ----------
         group_name (str): The name of the group containing the shapefiles.
         group_layer (QgsLayerTreeGroup): The group layer object containing the shapefiles.
+        save_folder (str): The folder where a folder with the dissolved shapefile is created for each country, optional.
+        workers (int): The number of worker processes, by default the number of CPUs.
 
     Returns
     ------
         None
     """
-    # iterating through the group layers
+    # collecting the shapefiles of the group layers
+    paths = {}
     for layer in group_layer.children():
         if isinstance(layer, QgsLayerTreeLayer) and layer.layer().type() == QgsMapLayer.VectorLayer:
-            # Get the shapefile layer
+            # Get the shapefile layer and its file path
             shapefile_layer = layer.layer()
-            
-            shapefile_layer_name = str(shapefile_layer)
-            
-            start = shapefile_layer_name.find(": <QgsVectorLayer: '") + len(": <QgsVectorLayer:'")
-            end = shapefile_layer_name.find("' (ogr)>")
-            extracted_string_country = shapefile_layer_name[start:end]
+            paths[shapefile_layer.name()] = shapefile_layer.source().split('|')[0]
             
             # Print the extracted country name
-            print(extracted_string_country)
-            
-            # Define the output path for the folder, up manually
-            folder_path = f"C:/Users/nikolaus/Desktop/Script_testing/Countries Dissolve/{extracted_string_country}"
-            
+            print(shapefile_layer.name())
+
+    # run the dissolve function for all countries
+    results = dissolveAll(paths, workers)
+    
+    # Define the group where the dissolved layers will be added
+    dissolved_group_name = "Dissolved Layers"
+    dissolved_group_layer = project.layerTreeRoot().findGroup(dissolved_group_name)
+
+    # If the group does not exist, create it
+    if not dissolved_group_layer:
+        dissolved_group_layer = project.layerTreeRoot().addGroup(dissolved_group_name)
+
+    for extracted_string_country, (wkb, crs_wkt) in results.items():
+        if wkb is None:
+            print(f"Failed to dissolve {extracted_string_country}, it has no geometries")
+            continue
+
+        if save_folder:
             # if the folder does not exist, create it
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
-                print(f"Directory {folder_path} was created.")
-            
-            # define the output path, go into the folder and save it there
-            output_path = f"{folder_path}/{extracted_string_country}_dissolved.shp"
+            folder_path = f"{save_folder}/{extracted_string_country}"
+            os.makedirs(folder_path, exist_ok=True)
+            output_path = saveGeometry(wkb, crs_wkt, f"{folder_path}/{extracted_string_country}_dissolved.shp")
+            print(f"Shp dissolved for {extracted_string_country}. Output saved as {output_path}")
 
-            # run the dissovle function
-            result = processing.run("native:dissolve", {
-                'INPUT':shapefile_layer,
-                'FIELD':[],
-                'SEPARATE_DISJOINT':False,
-                'OUTPUT': output_path
-            })
-            
-            # confirmation that the shape was saved
-            print(f"Shp dissolved for {shapefile_layer.name()}. Output saved as {output_path}")
-            
-            # Define the group where the dissolved layers will be added
-            dissolved_group_name = "Dissolved Layers"
-            dissolved_group_layer = project.layerTreeRoot().findGroup(dissolved_group_name)
+        # Create the dissolved layer in memory
+        dissolved_layer = QgsVectorLayer("MultiPolygon", f"{extracted_string_country}_dissolved", "memory")
+        dissolved_layer.setCrs(QgsCoordinateReferenceSystem.fromWkt(crs_wkt))
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkb(wkb))
+        dissolved_layer.dataProvider().addFeatures([feature])
+        dissolved_layer.updateExtents()
 
-            # If the group does not exist, create it
-            if not dissolved_group_layer:
-                dissolved_group_layer = project.layerTreeRoot().addGroup(dissolved_group_name)
-                        
-            # Load the dissolved shapefile into the project
-            dissolved_layer = QgsVectorLayer(result['OUTPUT'], f"{extracted_string_country}_dissolved", "ogr")
-            if not dissolved_layer.isValid():
-                print(f"Failed to load the dissolved layer for {extracted_string_country}")
-            else:
-                # Add the dissolved layer to the dissolved group
-                project.addMapLayer(dissolved_layer, False)
-                dissolved_group_layer.addLayer(dissolved_layer)
-                print(f"Shp dissolved for {shapefile_layer.name()}. Output saved as {output_path}")
+        # Add the dissolved layer to the dissolved group
+        project.addMapLayer(dissolved_layer, False)
+        dissolved_group_layer.addLayer(dissolved_layer)
+        print(f"Shp dissolved for {extracted_string_country}")
             
             
 # Call the dissolveLoop function
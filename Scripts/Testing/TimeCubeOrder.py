@@ -0,0 +1,39 @@
+# Description: Checks that appendToCube keeps the time coordinate of a cube sorted when the rasters of a
+# grid are appended out of order, as the parallel jobs of batchRunner.runGridCalculations finish.
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from timeCube import appendToCube, parseDate
+
+
+def checkOutOfOrder(folder):
+    """
+    Appends the months 200003, 200001, 200002 and 200001 again to a cube and checks its time steps.
+
+    Parameters:
+    -----------
+    folder : str
+        The folder the cube is written to.
+    """
+    import netCDF4
+
+    path = os.path.join(folder, 'cube.nc')
+    cells = {'adm_0': np.array(['A', 'B', 'C']), 'lat': np.array([1.0, 2.0, 3.0]), 'lon': np.array([4.0, 5.0, 6.0])}
+    for name, value in (('200003', 3), ('200001', 1), ('200002', 2), ('200001', 10)):
+        appendToCube(path, cells, parseDate(name), np.full(3, value))
+
+    with netCDF4.Dataset(path) as dataset:
+        times = np.asarray(dataset['time'][:])
+        means = np.asarray(dataset['mean'][:, 0])
+    assert np.all(np.diff(times) > 0), f"Time steps are not sorted: {times}"
+    assert list(means) == [10, 2, 3], f"Values are not at their time steps: {means}"
+    print(f"Time steps {times} with the values {means} are sorted")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        checkOutOfOrder(folder)
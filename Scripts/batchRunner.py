@@ -0,0 +1,293 @@
+# Description: Headless batch runner for the country x raster loops of processingTool.py and
+# CutSeaLevelRaise.py. Every (country, raster) pair is an independent job which runs in a worker
+# process with its own standalone QgsApplication.
+
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from jobManifest import JobManifest, fingerprint
+from stageMetrics import loadSpans, summarize
+
+# The keyword arguments of ProcessingTool which change the results, with the values used if they are not given
+PROCESSING_OPTIONS = {
+    'simplify': True,
+    'zonal_mode': 'coverage',
+    'statistics': ('count', 'sum', 'mean'),
+    'reprojection': 'warp',
+    'grid_spacing': 0.232,
+}
+
+# The QgsApplication of the worker process, it has to stay referenced while the worker lives
+qgs = None
+
+
+def initWorker():
+    """
+    Starts a standalone QgsApplication with the processing framework in a worker process.
+
+    The QGIS installation is taken from the QGIS_PREFIX_PATH environment variable.
+    """
+    global qgs
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qgis.core import QgsApplication
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    from processing.core.Processing import Processing
+    from qgis.analysis import QgsNativeAlgorithms
+    Processing.initialize()
+    QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+
+
+def layerName(path):
+    """
+    Returns the layer name for a file path, which is the file name without extension.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the file.
+
+    Returns:
+    --------
+    str
+        The layer name.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def loadLayers(vector_path, raster_path):
+    """
+    Replaces the layers of the worker's project by the given vector and raster file.
+
+    Parameters:
+    -----------
+    vector_path : str
+        The path of the vector file.
+    raster_path : str
+        The path of the raster file.
+    """
+    from qgis.core import QgsProject, QgsVectorLayer, QgsRasterLayer
+    project = QgsProject.instance()
+    project.removeAllMapLayers()
+    for layer in [QgsVectorLayer(vector_path, layerName(vector_path), 'ogr'),
+                  QgsRasterLayer(raster_path, layerName(raster_path))]:
+        if not layer.isValid():
+            raise ValueError(f"Layer {layer.name()} could not be loaded")
+        project.addMapLayer(layer)
+
+
+def runProcessingToolJob(job):
+    """
+    Runs the processingTool.py pipeline for one country and one raster.
+
+    Parameters:
+    -----------
+    job : tuple
+        The country path, the raster path, the output folder, the output format and the keyword
+        arguments of ProcessingTool.
+
+    Returns:
+    --------
+    tuple
+        The path of the CSV file, of the Parquet dataset or of the SQLite database, the number of bands
+        and the number of written rows.
+    """
+    country_path, raster_path, output_folder, output_format, options = job
+    loadLayers(country_path, raster_path)
+    from zonalPipeline import ProcessingTool
+    processing_tool = ProcessingTool(layerName(country_path), layerName(raster_path), output_folder, output_format, **options)
+    processing_tool.reproject()
+    processing_tool.createGrid()
+    processing_tool.extractGrid()
+    processing_tool.zonalStatistic()
+    return processing_tool.saveCSV(), processing_tool.band_count, processing_tool.row_count
+
+
+def runGridCalculationJob(job):
+    """
+    Runs the zonal statistic of CutSeaLevelRaise.py for one grid and one raster.
+
+    Parameters:
+    -----------
+    job : tuple
+        The grid path, the raster path, the output folder and the output format.
+
+    Returns:
+    --------
+    str
+        The path of the individual CSV file, of the Parquet dataset or of the NetCDF cube.
+    """
+    grid_path, raster_path, output_folder, output_format = job
+    loadLayers(grid_path, raster_path)
+    from gridPipeline import GridCalculationToCSV
+    grid_calculation = GridCalculationToCSV(layerName(grid_path), layerName(raster_path), output_folder, output_format)
+    return grid_calculation.zonalStatistic()
+
+
+def runCombineJob(output_folder):
+    """
+    Combines the individual CSV files of CutSeaLevelRaise.py into one file.
+
+    Parameters:
+    -----------
+    output_folder : str
+        The output folder of the grid calculation jobs.
+
+    Returns:
+    --------
+    str
+        The path of the combined CSV file.
+    """
+    from gridPipeline import combineCSVFiles
+    return combineCSVFiles(output_folder)
+
+
+def createExecutor(workers=None):
+    """
+    Creates a process pool whose workers run a standalone QgsApplication.
+
+    Parameters:
+    -----------
+    workers : int, optional
+        The number of worker processes, by default the number of CPUs.
+
+    Returns:
+    --------
+    ProcessPoolExecutor
+        The process pool.
+    """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=initWorker)
+
+
+def runProcessingTools(country_paths, raster_paths, output_folder, workers=None, output_format='csv', resume=True, options=None):
+    """
+    Runs the processingTool.py pipeline for every combination of country and raster in parallel.
+
+    Finished jobs are recorded in manifest.sqlite in the output folder. With resume, jobs which
+    finished in an earlier run, whose inputs and options did not change and whose rows are still in
+    the output are skipped. The stages of every job
+    are recorded in metrics.jsonl in the output folder and summarized at the end of the sweep.
+
+    Parameters:
+    -----------
+    country_paths : list of str
+        The paths of the country vector files.
+    raster_paths : list of str
+        The paths of the raster files.
+    output_folder : str
+        The folder where the CSV files are saved.
+    workers : int, optional
+        The number of worker processes, by default the number of CPUs.
+    output_format : str
+        The output format, 'csv', 'parquet' or 'sqlite'.
+    resume : bool
+        Whether finished jobs of an earlier run are skipped.
+    options : dict, optional
+        Keyword arguments of ProcessingTool, e.g. {'zonal_mode': 'center'}, see PROCESSING_OPTIONS for
+        the supported keys and the values used if they are not given.
+
+    Returns:
+    --------
+    list of str
+        The paths of the combined CSV files, ordered by country and raster.
+    """
+    unknown = set(options or {}) - set(PROCESSING_OPTIONS)
+    if unknown:
+        raise ValueError(f"Options {sorted(unknown)} are not supported")
+    options = dict(PROCESSING_OPTIONS, **(options or {}))
+    options['statistics'] = tuple(options['statistics'])
+    jobs = [(country_path, raster_path, output_folder, output_format, options)
+            for country_path in sorted(country_paths) for raster_path in sorted(raster_paths)]
+    os.makedirs(output_folder, exist_ok=True)
+    sweep_start = time.time()
+    manifest = JobManifest(os.path.join(output_folder, 'manifest.sqlite'))
+
+    results = [None] * len(jobs)
+    fingerprints = []
+    for index, (country_path, raster_path, _, _, _) in enumerate(jobs):
+        # The fingerprint covers exactly the arguments the job runs with
+        fingerprints.append(fingerprint([country_path, raster_path], output_format=output_format, **options))
+        if resume:
+            results[index] = manifest.finishedOutput(layerName(country_path), layerName(raster_path), fingerprints[index])
+    pending = [index for index, result in enumerate(results) if result is None]
+    print(f"{len(jobs) - len(pending)} of {len(jobs)} jobs are already finished")
+
+    # Every finished job is recorded right away, so a crash only loses the running jobs
+    failed = []
+    with createExecutor(workers) as executor:
+        futures = {executor.submit(runProcessingToolJob, jobs[index]): index for index in pending}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                output, band_count, rows = future.result()
+            except Exception as error:
+                print(f"Job {jobs[index][0]} {jobs[index][1]} failed: {error}")
+                failed.append(index)
+                continue
+            manifest.record(layerName(jobs[index][0]), layerName(jobs[index][1]), band_count, fingerprints[index], output,
+                            output_format, rows)
+            results[index] = output
+    print(f"{len(pending) - len(failed)} jobs were processed")
+    spans = loadSpans(os.path.join(output_folder, 'metrics.jsonl'), since=sweep_start)
+    if spans:
+        summarize(spans)
+    if failed:
+        raise RuntimeError(f"{len(failed)} jobs failed, run again to retry them")
+    return results
+
+
+def runGridCalculations(grid_paths, raster_paths, output_folder, workers=None, output_format='csv'):
+    """
+    Runs the CutSeaLevelRaise.py zonal statistic for every combination of grid and raster in parallel
+    and combines the individual CSV files once all jobs are done.
+
+    Parameters:
+    -----------
+    grid_paths : list of str
+        The paths of the grid vector files.
+    raster_paths : list of str
+        The paths of the raster files.
+    output_folder : str
+        The folder where the CSV files are saved.
+    workers : int, optional
+        The number of worker processes, by default the number of CPUs.
+    output_format : str
+        The output format, 'csv', 'parquet' or 'netcdf'.
+
+    Returns:
+    --------
+    str
+        The path of the combined CSV file, of the Parquet dataset or of the folder of the NetCDF cubes.
+    """
+    jobs = [(grid_path, raster_path, output_folder, output_format)
+            for grid_path in sorted(grid_paths) for raster_path in sorted(raster_paths)]
+    with createExecutor(workers) as executor:
+        results = list(executor.map(runGridCalculationJob, jobs))
+        print(f"{len(results)} jobs were processed")
+        if output_format == 'parquet':
+            # All jobs write into the same partitioned dataset, there is nothing to combine
+            return results[0] if results else None
+        if output_format == 'netcdf':
+            # Every grid has its own cube, the rasters are appended as time steps
+            return os.path.join(output_folder, 'cube')
+        return executor.submit(runCombineJob, output_folder).result()
+
+
+# Example usage
+if __name__ == "__main__":
+    import glob
+
+    data_path = "C:/Users/nikolaus/Desktop/Script_testing/KfW_script/"
+    runProcessingTools(glob.glob(os.path.join(data_path, 'countries', '*.shp')),
+                       glob.glob(os.path.join(data_path, 'cordex', '*.nc')),
+                       data_path,
+                       workers=32)
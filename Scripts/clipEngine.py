@@ -0,0 +1,316 @@
+# Description: Parallel clipping of one raster by many country masks. The georeferencing of the raster
+# is read once, the window of every country is computed from its mask extent and the clipped outputs
+# are written by worker threads (GDAL releases the GIL while warping). The netCDF driver serializes all
+# calls behind a global lock, so NetCDF sources and outputs are clipped in worker processes instead.
+# With the VRT format only a small
+# XML file referencing the source window and the cutline is written, which can be materialized later.
+# Optionally the masks are simplified with a tolerance of a tenth of the pixel size before clipping.
+
+import os
+import math
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from osgeo import gdal, ogr, osr
+from dissolveEngine import saveGeometry
+from processPool import processContext
+from maskSimplify import MaskCache, toleranceForSpacing, readGeometries, mergeGeometries
+
+# File extension and creation options of the supported output formats
+OUTPUT_FORMATS = {
+    'GTiff': ('.tif', ['COMPRESS=DEFLATE', 'TILED=YES']),
+    'COG': ('.tif', ['COMPRESS=DEFLATE']),
+    'netCDF': ('.nc', ['FORMAT=NC4C', 'COMPRESS=DEFLATE']),
+    'VRT': ('.vrt', []),
+}
+
+# The ClipEngine of a worker process by raster and output format, so every process opens the raster once
+process_engines = {}
+
+
+def clipInProcess(raster_path, output_format, mask_path, output_path):
+    """
+    Clips a raster by one mask in a worker process, see ClipEngine.clip.
+
+    Parameters:
+    -----------
+    raster_path : str
+        The GDAL readable path of the raster.
+    output_format : str
+        The output format, one of OUTPUT_FORMATS.
+    mask_path : str
+        The path of the mask vector file.
+    output_path : str
+        The path of the clipped raster.
+
+    Returns:
+    --------
+    str or None
+        The path of the clipped raster, None if the mask is outside of the raster.
+    """
+    key = (raster_path, output_format)
+    if key not in process_engines:
+        process_engines[key] = ClipEngine(raster_path, output_format, workers=1)
+    return process_engines[key].clip(mask_path, output_path)
+
+
+class ClipEngine:
+    """
+    A class to clip a raster by country masks in parallel threads, or processes for NetCDF.
+
+    Attributes:
+    -----------
+    raster_path : str
+        The GDAL readable path of the raster.
+    output_format : str
+        The output format, one of OUTPUT_FORMATS.
+    workers : int
+        The number of worker threads or processes.
+    uses_processes : bool
+        Whether the masks are clipped in worker processes, as the netCDF driver of the source or
+        output does not run in parallel threads. VRT outputs are always written by threads.
+    geotransform : tuple
+        The geotransform of the raster.
+    projection : str
+        The projection of the raster as WKT.
+    size : tuple of int
+        The width and height of the raster in pixels.
+    nodata : float or None
+        The nodata value of the first band.
+    mask_cache : MaskCache or None
+        The cache of the simplified masks, None if the masks are used unchanged.
+
+    Methods:
+    --------
+    __init__(self, raster_path, output_format='GTiff', workers=None, simplify=False, mask_cache=None):
+        Reads the georeferencing of the raster.
+
+    dataset(self):
+        Returns the raster dataset of the current thread.
+
+    maskWindow(self, mask_path):
+        Returns the bounds of the pixel window covering a mask.
+
+    clip(self, mask_path, output_path):
+        Clips the raster by one mask.
+
+    simplifiedMask(self, name, mask):
+        Returns the simplified geometry of a mask.
+
+    clipAll(self, masks, output_folder):
+        Clips the raster by all masks in parallel.
+    """
+
+    def __init__(self, raster_path, output_format='GTiff', workers=None, simplify=False, mask_cache=None):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Output format {output_format} is not supported")
+        self.raster_path = raster_path
+        self.output_format = output_format
+        self.workers = workers or os.cpu_count()
+        self.local = threading.local()
+
+        dataset = self.dataset()
+        self.geotransform = dataset.GetGeoTransform()
+        self.projection = dataset.GetProjection()
+        self.size = (dataset.RasterXSize, dataset.RasterYSize)
+        self.nodata = dataset.GetRasterBand(1).GetNoDataValue()
+        netcdf_source = dataset.GetDriver().ShortName == 'netCDF'
+        self.uses_processes = output_format == 'netCDF' or (netcdf_source and output_format != 'VRT')
+        self.mask_cache = (mask_cache or MaskCache()) if simplify else None
+
+    def dataset(self):
+        """
+        Returns the raster dataset of the current thread.
+
+        GDAL datasets must not be shared between threads, so every thread opens the raster once
+        and reuses its handle for all of its masks.
+
+        Returns:
+        --------
+        gdal.Dataset
+            The raster dataset.
+        """
+        if getattr(self.local, 'dataset', None) is None:
+            self.local.dataset = gdal.Open(self.raster_path)
+            if self.local.dataset is None:
+                raise ValueError(f"Raster {self.raster_path} could not be opened")
+        return self.local.dataset
+
+    def maskWindow(self, mask_path):
+        """
+        Returns the bounds of the pixel window covering a mask, snapped to the pixels of the raster.
+
+        Parameters:
+        -----------
+        mask_path : str
+            The path of the mask vector file.
+
+        Returns:
+        --------
+        tuple of float
+            The x_min, y_min, x_max and y_max of the window, None if the mask is outside of the raster.
+        """
+        source = ogr.Open(mask_path)
+        if source is None:
+            raise ValueError(f"Mask {mask_path} could not be opened")
+        layer = source.GetLayer(0)
+        x_min, x_max, y_min, y_max = layer.GetExtent()
+
+        mask_srs = layer.GetSpatialRef()
+        raster_srs = osr.SpatialReference(wkt=self.projection) if self.projection else None
+        if mask_srs is not None and raster_srs is not None and not mask_srs.IsSame(raster_srs):
+            mask_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            transform = osr.CoordinateTransformation(mask_srs, raster_srs)
+            x_min, y_min, x_max, y_max = transform.TransformBounds(x_min, y_min, x_max, y_max, 21)
+
+        origin_x, pixel_width, _, origin_y, _, pixel_height = self.geotransform
+        column_start = max(0, math.floor((x_min - origin_x) / pixel_width))
+        column_end = min(self.size[0], math.ceil((x_max - origin_x) / pixel_width))
+        row_start = max(0, math.floor((y_max - origin_y) / pixel_height))
+        row_end = min(self.size[1], math.ceil((y_min - origin_y) / pixel_height))
+        if column_start >= column_end or row_start >= row_end:
+            return None
+        return (origin_x + column_start * pixel_width, origin_y + row_end * pixel_height,
+                origin_x + column_end * pixel_width, origin_y + row_start * pixel_height)
+
+    def clip(self, mask_path, output_path):
+        """
+        Clips the raster by one mask, keeping the resolution and pixel alignment of the raster.
+
+        Parameters:
+        -----------
+        mask_path : str
+            The path of the mask vector file.
+        output_path : str
+            The path of the clipped raster.
+
+        Returns:
+        --------
+        str or None
+            The path of the clipped raster, None if the mask is outside of the raster.
+        """
+        window = self.maskWindow(mask_path)
+        if window is None:
+            print(f"Mask {mask_path} does not overlap the raster")
+            return None
+        creation_options = OUTPUT_FORMATS[self.output_format][1]
+        result = gdal.Warp(output_path, self.dataset(),
+                           format=self.output_format,
+                           outputBounds=window,
+                           xRes=abs(self.geotransform[1]),
+                           yRes=abs(self.geotransform[5]),
+                           cutlineDSName=mask_path,
+                           srcNodata=self.nodata,
+                           dstNodata=self.nodata,
+                           creationOptions=creation_options)
+        if result is None:
+            raise RuntimeError(f"Clipping {self.raster_path} by {mask_path} failed")
+        result = None
+        return output_path
+
+    def simplifiedMask(self, name, mask):
+        """
+        Returns the simplified geometry of a mask. Masks in another CRS than the raster are not simplified,
+        as the tolerance is given in raster units.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the mask.
+        mask : str or tuple
+            The path of the mask vector file or its geometry as (WKB, CRS WKT).
+
+        Returns:
+        --------
+        str or tuple
+            The mask unchanged or its simplified geometry as (WKB, CRS WKT).
+        """
+        geometries, srs_wkt = ([mask[0]], mask[1]) if isinstance(mask, tuple) else readGeometries(mask)
+        raster_srs = osr.SpatialReference(wkt=self.projection) if self.projection else None
+        if srs_wkt and raster_srs is not None and not osr.SpatialReference(wkt=srs_wkt).IsSame(raster_srs):
+            return mask
+        tolerance = toleranceForSpacing(self.geotransform[1])
+        return mergeGeometries(self.mask_cache.simplified(name, geometries, tolerance)), srs_wkt
+
+    def clipAll(self, masks, output_folder):
+        """
+        Clips the raster by all masks in parallel, each output is written to a folder named after the mask.
+
+        The masks are clipped in worker threads, or in worker processes if uses_processes is set.
+
+        Parameters:
+        -----------
+        masks : dict
+            The mask names and the paths of their vector files, or their geometries as (WKB, CRS WKT)
+            like dissolveEngine.dissolveAll returns them.
+        output_folder : str
+            The folder of the clipped rasters.
+
+        Returns:
+        --------
+        dict
+            The mask names and the paths of their clipped rasters, in the order of masks.
+        """
+        extension = OUTPUT_FORMATS[self.output_format][0]
+        jobs = {}
+        memory_paths = []
+        # Worker processes can not read the in-memory files of this process, their masks are written to disk
+        mask_folder = tempfile.mkdtemp(prefix='clip_masks_') if self.uses_processes else None
+        try:
+            for name, mask in masks.items():
+                if self.mask_cache is not None:
+                    mask = self.simplifiedMask(name, mask)
+                if isinstance(mask, tuple):
+                    # Geometries in memory are handed to GDAL as an in-memory file
+                    folder = mask_folder or '/vsimem'
+                    mask = saveGeometry(mask[0], mask[1], f'{folder}/clip_{name}.gpkg')
+                    memory_paths.append(mask)
+                country_folder = os.path.join(output_folder, name)
+                os.makedirs(country_folder, exist_ok=True)
+                jobs[name] = (mask, os.path.join(country_folder, f'{name}{extension}'))
+
+            if self.uses_processes:
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=processContext()) as executor:
+                    futures = {name: executor.submit(clipInProcess, self.raster_path, self.output_format, *job)
+                               for name, job in jobs.items()}
+                    return {name: future.result() for name, future in futures.items()}
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {name: executor.submit(self.clip, *job) for name, job in jobs.items()}
+                return {name: future.result() for name, future in futures.items()}
+        finally:
+            if mask_folder:
+                shutil.rmtree(mask_folder, ignore_errors=True)
+            else:
+                for path in memory_paths:
+                    gdal.Unlink(path)
+
+
+def materialize(vrt_path, output_format='GTiff', output_path=None):
+    """
+    Writes the pixels of a clipped VRT to a physical raster.
+
+    Parameters:
+    -----------
+    vrt_path : str
+        The path of the VRT written by ClipEngine.
+    output_format : str
+        The output format, one of OUTPUT_FORMATS except 'VRT'.
+    output_path : str, optional
+        The path of the raster, by default the VRT path with the extension of the format.
+
+    Returns:
+    --------
+    str
+        The path of the raster.
+    """
+    if output_format not in OUTPUT_FORMATS or output_format == 'VRT':
+        raise ValueError(f"Output format {output_format} can not be materialized")
+    extension, creation_options = OUTPUT_FORMATS[output_format]
+    output_path = output_path or os.path.splitext(vrt_path)[0] + extension
+    result = gdal.Translate(output_path, vrt_path, format=output_format, creationOptions=creation_options)
+    if result is None:
+        raise RuntimeError(f"Materializing {vrt_path} failed")
+    result = None
+    return output_path
@@ -0,0 +1,230 @@
+# Description: Spatially indexed extraction of grid cells by a country mask. The grid cells are indexed
+# once, every country feature is prepared once and the cells are classified as inside, boundary or
+# outside. Exact geometry work is only done for the boundary cells. The country features can be replaced
+# by simplified masks, see maskSimplify.
+
+from qgis.core import QgsSpatialIndex, QgsVectorLayer, QgsFeature, QgsFeatureRequest, QgsFields, QgsWkbTypes, QgsGeometry
+
+
+def polygonParts(geometry):
+    """
+    Returns the polygon parts of a geometry as a multipolygon.
+
+    The intersection of a cell which only touches the border is a line or point, or a collection
+    mixing them with polygons. Like native:intersection only the polygon parts are kept.
+
+    Parameters:
+    -----------
+    geometry : QgsGeometry
+        The geometry, e.g. the intersection of a cell and a country feature.
+
+    Returns:
+    --------
+    QgsGeometry
+        The polygon parts as multipolygon, an empty geometry if there are none.
+    """
+    if geometry.isNull() or geometry.isEmpty():
+        return QgsGeometry()
+    if geometry.type() != QgsWkbTypes.PolygonGeometry:
+        parts = [part for part in geometry.asGeometryCollection() if part.type() == QgsWkbTypes.PolygonGeometry]
+        if not parts:
+            return QgsGeometry()
+        geometry = QgsGeometry.collectGeometry(parts)
+    geometry.convertToMultiType()
+    return geometry
+
+
+class CountryMask:
+    """
+    A class to select and intersect grid cells with the features of a country layer.
+
+    Attributes:
+    -----------
+    country_layer : QgsVectorLayer
+        The country layer.
+    country_features : list of QgsFeature
+        The features of the country layer, with simplified geometries if a tolerance is given.
+
+    Methods:
+    --------
+    __init__(self, country_layer, tolerance=None, mask_cache=None):
+        Initializes the CountryMask with the features of the country layer.
+
+    geometries(self):
+        Returns the geometries of the country features as WKB.
+
+    classify(self, grid):
+        Classifies the grid cells as inside or on the boundary of every country feature.
+
+    extract(self, grid, name='Extracted'):
+        Returns the grid cells intersecting the country as a memory layer.
+
+    intersect(self, grid, name='Intersection'):
+        Returns the grid cells clipped to the country features as a memory layer.
+
+    createLayer(self, grid, geometry_type, fields, name):
+        Creates an empty memory layer with the CRS of the grid.
+    """
+
+    def __init__(self, country_layer, tolerance=None, mask_cache=None):
+        self.country_layer = country_layer
+        self.country_features = [feature for feature in country_layer.getFeatures() if feature.hasGeometry()]
+        if tolerance:
+            # The simplified masks are cached per country, so every grid of a country reuses them
+            simplified = mask_cache.simplified(country_layer.name(), self.geometries(), tolerance)
+            for feature, wkb in zip(self.country_features, simplified):
+                geometry = QgsGeometry()
+                geometry.fromWkb(wkb)
+                feature.setGeometry(geometry)
+
+    def geometries(self):
+        """
+        Returns the geometries of the country features as WKB.
+
+        Returns:
+        --------
+        list of bytes
+            The geometries in the order of the country features.
+        """
+        return [bytes(feature.geometry().asWkb()) for feature in self.country_features]
+
+    def classify(self, grid):
+        """
+        Classifies the grid cells as inside or on the boundary of every country feature.
+
+        Candidates are taken from a spatial index of the grid, then tested against the prepared
+        geometry of the country feature. Cells outside of all features are not returned.
+
+        Parameters:
+        -----------
+        grid : QgsVectorLayer
+            The grid layer.
+
+        Returns:
+        --------
+        list of tuple
+            The country feature, the ids of the cells inside it and the ids of the cells on its boundary.
+        """
+        cells = {feature.id(): feature.geometry() for feature in grid.getFeatures()}
+        index = QgsSpatialIndex()
+        for fid, geometry in cells.items():
+            index.addFeature(fid, geometry.boundingBox())
+
+        classes = []
+        for country_feature in self.country_features:
+            country_geometry = country_feature.geometry()
+            engine = country_geometry.createGeometryEngine(country_geometry.constGet())
+            engine.prepareGeometry()
+            inside = []
+            boundary = []
+            for fid in index.intersects(country_geometry.boundingBox()):
+                cell = cells[fid].constGet()
+                if engine.contains(cell):
+                    inside.append(fid)
+                elif engine.intersects(cell):
+                    boundary.append(fid)
+            classes.append((country_feature, inside, boundary))
+        return classes
+
+    def extract(self, grid, name='Extracted'):
+        """
+        Returns the grid cells intersecting the country as a memory layer.
+
+        Parameters:
+        -----------
+        grid : QgsVectorLayer
+            The grid layer.
+        name : str
+            The name of the layer.
+
+        Returns:
+        --------
+        QgsVectorLayer
+            The grid cells which are inside or on the boundary of any country feature.
+        """
+        fids = set()
+        for _, inside, boundary in self.classify(grid):
+            fids.update(inside)
+            fids.update(boundary)
+
+        output = self.createLayer(grid, QgsWkbTypes.displayString(grid.wkbType()), grid.fields(), name)
+        features = grid.getFeatures(QgsFeatureRequest().setFilterFids(sorted(fids)))
+        output.dataProvider().addFeatures(list(features))
+        output.updateExtents()
+        return output
+
+    def intersect(self, grid, name='Intersection'):
+        """
+        Returns the grid cells clipped to the country features as a memory layer.
+
+        Like native:intersection one feature per pair of cell and country feature is created, with the
+        attributes of both. Cells inside a country feature keep their geometry, only the boundary cells
+        are intersected and only the polygon parts of their intersection are kept, see polygonParts.
+
+        Parameters:
+        -----------
+        grid : QgsVectorLayer
+            The grid layer.
+        name : str
+            The name of the layer.
+
+        Returns:
+        --------
+        QgsVectorLayer
+            The intersected grid cells.
+        """
+        fields = QgsFields(grid.fields())
+        for field in self.country_layer.fields():
+            if fields.indexOf(field.name()) == -1:
+                fields.append(field)
+        output = self.createLayer(grid, 'MultiPolygon', fields, name)
+
+        features = []
+        for country_feature, inside, boundary in self.classify(grid):
+            country_geometry = country_feature.geometry()
+            boundary = set(boundary)
+            for cell in grid.getFeatures(QgsFeatureRequest().setFilterFids(inside + sorted(boundary))):
+                geometry = cell.geometry()
+                if cell.id() in boundary:
+                    geometry = polygonParts(geometry.intersection(country_geometry))
+                    if geometry.isEmpty():
+                        continue
+                else:
+                    geometry.convertToMultiType()
+                feature = QgsFeature(fields)
+                feature.setGeometry(geometry)
+                for field in grid.fields():
+                    feature[field.name()] = cell[field.name()]
+                for field in self.country_layer.fields():
+                    if grid.fields().indexOf(field.name()) == -1:
+                        feature[field.name()] = country_feature[field.name()]
+                features.append(feature)
+        output.dataProvider().addFeatures(features)
+        output.updateExtents()
+        return output
+
+    def createLayer(self, grid, geometry_type, fields, name):
+        """
+        Creates an empty memory layer with the CRS of the grid.
+
+        Parameters:
+        -----------
+        grid : QgsVectorLayer
+            The grid layer.
+        geometry_type : str
+            The geometry type of the layer, e.g. 'Polygon'.
+        fields : QgsFields
+            The fields of the layer.
+        name : str
+            The name of the layer.
+
+        Returns:
+        --------
+        QgsVectorLayer
+            The memory layer.
+        """
+        output = QgsVectorLayer(geometry_type, name, 'memory')
+        output.setCrs(grid.crs())
+        output.dataProvider().addAttributes(fields.toList())
+        output.updateFields()
+        return output
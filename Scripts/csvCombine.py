@@ -0,0 +1,174 @@
+# Description: Incremental combination of the individual CSV files of CutSeaLevelRaise.py. The cells
+# are indexed once by their key columns and only files which are new or changed since the last
+# combination are read, the columns of deleted files are dropped.
+
+import os
+import pandas as pd
+
+
+class CSVCombiner:
+    """
+    A class to combine individual CSV files into one wide table, one column per value column of the files.
+
+    Attributes:
+    -----------
+    folder : str
+        The folder containing the individual CSV files.
+    keys : list of str
+        The columns identifying a grid cell.
+    combined : pandas.DataFrame
+        The combined table indexed by the key columns.
+    processed : dict
+        The (size, mtime_ns) of the files which are already part of the combined table, by file name.
+    file_columns : dict
+        The value columns every processed file added to the combined table, by file name.
+
+    Methods:
+    --------
+    __init__(self, folder, keys):
+        Initializes the CSVCombiner for the given folder.
+
+    signatures(self):
+        Returns the (size, mtime_ns) of the CSV files of the folder.
+
+    newFiles(self, signatures):
+        Returns the CSV files of the folder which were not combined yet or changed since.
+
+    dropFiles(self, file_names):
+        Drops the columns of files from the combined table.
+
+    update(self):
+        Appends the new and changed CSV files to the combined table.
+    """
+
+    def __init__(self, folder, keys=('adm_0', 'Lat', 'Lon')):
+        self.folder = folder
+        self.keys = list(keys)
+        self.combined = None
+        self.processed = {}
+        self.file_columns = {}
+
+    def signatures(self):
+        """
+        Returns the (size, mtime_ns) of the CSV files of the folder.
+
+        Returns:
+        --------
+        dict
+            The signature of every CSV file by file name.
+        """
+        signatures = {}
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith('.csv'):
+                try:
+                    stat = os.stat(os.path.join(self.folder, file_name))
+                except FileNotFoundError:
+                    continue
+                signatures[file_name] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def newFiles(self, signatures):
+        """
+        Returns the CSV files of the folder which were not combined yet or were rewritten since.
+
+        Parameters:
+        -----------
+        signatures : dict
+            The signatures of the CSV files of the folder, see signatures.
+
+        Returns:
+        --------
+        list of str
+            The sorted file names.
+        """
+        return sorted(file_name for file_name, signature in signatures.items()
+                      if self.processed.get(file_name) != signature)
+
+    def dropFiles(self, file_names):
+        """
+        Drops the columns of files from the combined table, cells without any remaining value are removed.
+
+        Columns which are also added by a file which is kept stay in the table.
+
+        Parameters:
+        -----------
+        file_names : list of str
+            The names of the deleted or changed files.
+        """
+        columns = set()
+        for file_name in file_names:
+            columns.update(self.file_columns.pop(file_name, []))
+            self.processed.pop(file_name, None)
+        for kept_columns in self.file_columns.values():
+            columns.difference_update(kept_columns)
+        if self.combined is not None and columns:
+            self.combined = self.combined.drop(columns=sorted(columns)).dropna(how='all')
+
+    def update(self):
+        """
+        Appends the new and changed CSV files to the combined table.
+
+        The columns of deleted and changed files are dropped first. All new and changed files are
+        stacked into one long table and pivoted to columns in a single step, existing cells keep
+        their row and new cells are added.
+
+        Returns:
+        --------
+        pandas.DataFrame
+            The combined table indexed by the key columns.
+        """
+        signatures = self.signatures()
+        file_names = self.newFiles(signatures)
+        self.dropFiles([file_name for file_name in self.processed if file_name not in signatures or file_name in file_names])
+        if not file_names:
+            return self.combined
+
+        frames = []
+        for file_name in file_names:
+            df = pd.read_csv(os.path.join(self.folder, file_name))
+            self.file_columns[file_name] = [column for column in df.columns if column not in self.keys]
+            frames.append(df.melt(id_vars=self.keys, var_name='column'))
+        long_df = pd.concat(frames)
+        new_df = long_df.groupby(self.keys + ['column'], sort=False)['value'].first().unstack('column')
+        new_df.columns.name = None
+
+        if self.combined is None:
+            self.combined = new_df
+        elif new_df.columns.intersection(self.combined.columns).empty:
+            self.combined = pd.concat([self.combined, new_df], axis=1)
+        else:
+            self.combined = new_df.combine_first(self.combined)
+        self.combined = self.combined[sorted(self.combined.columns)]
+        self.processed.update((file_name, signatures[file_name]) for file_name in file_names)
+        return self.combined
+
+
+# One combiner per folder, so repeated combinations within a session only read new and changed files
+combiners = {}
+
+
+def combineFolder(folder, output_csv_path, keys=('adm_0', 'Lat', 'Lon')):
+    """
+    Combines the CSV files of a folder incrementally and saves the result.
+
+    Parameters:
+    -----------
+    folder : str
+        The folder containing the individual CSV files.
+    output_csv_path : str
+        The path of the combined CSV file.
+    keys : tuple of str
+        The columns identifying a grid cell.
+
+    Returns:
+    --------
+    str
+        The path of the combined CSV file.
+    """
+    if folder not in combiners:
+        combiners[folder] = CSVCombiner(folder, keys)
+    combined_df = combiners[folder].update()
+    if combined_df is None or not combiners[folder].processed:
+        raise ValueError(f"No CSV files found in {folder}")
+    combined_df.reset_index().to_csv(output_csv_path, index=False)
+    return output_csv_path
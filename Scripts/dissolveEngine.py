@@ -0,0 +1,101 @@
+# Description: Parallel dissolve of country shapefiles. Every country is dissolved in its own process
+# with a cascaded unary union, the results are returned as WKB geometries in memory instead of being
+# written to shapefiles and loaded again.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from osgeo import ogr, osr
+from processPool import processContext
+
+
+def dissolveFile(path):
+    """
+    Dissolves all features of a vector file into one geometry.
+
+    The polygons are merged with a cascaded unary union, which orders them in an STRtree and unions
+    neighbouring polygons first, instead of adding them to the result one by one.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the vector file.
+
+    Returns:
+    --------
+    tuple
+        The dissolved geometry as WKB (None if the file has no geometries) and the CRS as WKT.
+    """
+    source = ogr.Open(path)
+    if source is None:
+        raise ValueError(f"Vector file {path} could not be opened")
+    layer = source.GetLayer(0)
+    srs = layer.GetSpatialRef()
+
+    collection = ogr.Geometry(ogr.wkbMultiPolygon)
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None or geometry.IsEmpty():
+            continue
+        if not geometry.IsValid():
+            geometry = geometry.MakeValid()
+        geometry = ogr.ForceToMultiPolygon(geometry)
+        for index in range(geometry.GetGeometryCount()):
+            collection.AddGeometry(geometry.GetGeometryRef(index))
+
+    if collection.IsEmpty():
+        return None, srs.ExportToWkt() if srs else ''
+    union = collection.UnaryUnion() if hasattr(collection, 'UnaryUnion') else collection.UnionCascaded()
+    return bytes(union.ExportToWkb()), srs.ExportToWkt() if srs else ''
+
+
+def dissolveAll(paths, workers=None):
+    """
+    Dissolves every vector file in its own worker process.
+
+    Parameters:
+    -----------
+    paths : dict
+        The country names and the paths of their vector files.
+    workers : int, optional
+        The number of worker processes, by default the number of CPUs.
+
+    Returns:
+    --------
+    dict
+        The country names and their dissolved geometry as (WKB, CRS WKT), in the order of paths.
+    """
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=processContext()) as executor:
+        results = executor.map(dissolveFile, paths.values())
+        return dict(zip(paths.keys(), results))
+
+
+def saveGeometry(wkb, srs_wkt, output_path):
+    """
+    Saves a dissolved geometry as a single feature vector file.
+
+    Parameters:
+    -----------
+    wkb : bytes
+        The geometry as WKB.
+    srs_wkt : str
+        The CRS as WKT.
+    output_path : str
+        The path of the vector file, the driver is chosen by its extension (.shp, .gpkg).
+
+    Returns:
+    --------
+    str
+        The path of the vector file.
+    """
+    driver_name = 'GPKG' if output_path.endswith('.gpkg') else 'ESRI Shapefile'
+    driver = ogr.GetDriverByName(driver_name)
+    if os.path.exists(output_path) or output_path.startswith('/vsimem/'):
+        driver.DeleteDataSource(output_path)
+    source = driver.CreateDataSource(output_path)
+    srs = osr.SpatialReference(wkt=srs_wkt) if srs_wkt else None
+    layer = source.CreateLayer(os.path.splitext(os.path.basename(output_path))[0], srs, ogr.wkbMultiPolygon)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.ForceToMultiPolygon(ogr.CreateGeometryFromWkb(wkb)))
+    layer.CreateFeature(feature)
+    source = None
+    return output_path
@@ -0,0 +1,66 @@
+# Description: Bulk attribute writes for grid layers. The cell centers of a grid are
+# calculated for all cells at once and the attributes are written with a single
+# changeAttributeValues call on the data provider instead of one updateFeature per cell.
+
+import numpy as np
+from qgis.core import QgsFeatureRequest
+
+
+def cellCenters(grid):
+    """
+    Calculates the centers of all cells of a grid.
+
+    Cells which fill their bounding box are rectangles, their center is the center of the bounding
+    box. All other cells, e.g. cells intersected with a country boundary, get their centroid, so the
+    coordinates match native:centroids. The left, top, right and bottom attributes of
+    native:creategrid are not used, they keep the bounds of a cell after it was intersected. Grids
+    created from a RegularGrid get their centers from the cell bounds instead, see ProcessingTool.createGrid.
+
+    Parameters:
+    -----------
+    grid : QgsVectorLayer
+        The grid layer.
+
+    Returns:
+    --------
+    tuple of numpy.ndarray
+        The feature ids, the longitudes and the latitudes of the cell centers.
+    """
+    request = QgsFeatureRequest().setNoAttributes()
+    rows = []
+    for feature in grid.getFeatures(request):
+        geometry = feature.geometry()
+        box = geometry.boundingBox()
+        if abs(geometry.area() - box.area()) > 1e-9 * box.area():
+            center = geometry.centroid().asPoint()
+            rows.append([feature.id(), center.x(), center.y()])
+        else:
+            rows.append([feature.id(), (box.xMinimum() + box.xMaximum()) / 2, (box.yMinimum() + box.yMaximum()) / 2])
+
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+
+def setAttributes(grid, fields, fids, columns):
+    """
+    Adds fields to a layer and writes their values for all features in one batch.
+
+    Parameters:
+    -----------
+    grid : QgsVectorLayer
+        The layer to change.
+    fields : list of QgsField
+        The fields to add.
+    fids : numpy.ndarray
+        The ids of the features to change.
+    columns : list
+        One sequence of values per field, in the order of fids.
+    """
+    provider = grid.dataProvider()
+    provider.addAttributes(fields)
+    grid.updateFields()
+
+    indices = [grid.fields().indexOf(field.name()) for field in fields]
+    columns = [column.tolist() if isinstance(column, np.ndarray) else list(column) for column in columns]
+    changes = {fid: dict(zip(indices, values)) for fid, values in zip(fids.tolist(), zip(*columns))}
+    provider.changeAttributeValues(changes)
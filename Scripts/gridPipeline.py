@@ -0,0 +1,189 @@
+# Description: The GridCalculationToCSV pipeline of CutSeaLevelRaise.py (zonal statistics of a grid for one
+# raster and the combination of the individual CSV files). It is kept in its own module so the batch runner
+# workers can import it without running the example loop of the script.
+
+import os
+import re
+import sys
+from osgeo import gdal
+from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsVectorLayer, QgsField, QgsVectorFileWriter
+import processing
+import pandas as pd
+import numpy as np
+from PyQt5.QtCore import QVariant
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from csvCombine import combineFolder
+from zonalOutput import openSink
+from timeCube import appendToCube, parseDate
+from zonalEngine import ZonalEngine
+from weightCache import WeightCache
+
+# Folder path
+folder_path = f"C:/Users/nikolaus/Documents/KfW Project/Data/02_PostData/LYB"
+
+class GridCalculationToCSV:
+    def __init__(self, shapefile_layer_name, raster_name, output_folder=folder_path, output_format='csv', zonal_mode='coverage'):
+        if output_format not in ('csv', 'parquet', 'netcdf'):
+            raise ValueError(f"Output format {output_format} is not supported")
+        self.project = QgsProject.instance()
+        self.raster_name = raster_name
+        self.shapefile_layer_name = shapefile_layer_name
+        self.output_folder = output_folder
+        self.output_format = output_format
+        self.zonal_mode = zonal_mode
+        self.raster_layer = self.loadFile(self.raster_name)
+        self.grid = self.loadFile(self.shapefile_layer_name)
+        self.gridIntersect = None
+        self.gridExtract = None
+        self.zonal_stats_results = []
+        self.date = self.extract_date(self.raster_name)
+        
+    def loadFile(self, layer_name):
+        """
+        Loads a layer by its name from the QGIS project.
+
+        Parameters:
+        -----------
+        layer_name : str
+            The name of the layer to load.
+
+        Returns:
+        --------
+        QgsVectorLayer or QgsRasterLayer
+            The loaded layer.
+        """
+        layers = self.project.mapLayersByName(layer_name)
+        if not layers:
+            raise ValueError(f"Layer {layer_name} not found")
+        print(f"{layer_name} loaded")
+        return layers[0]
+        
+    def extract_date(self, string):
+        """
+        Extracts the date part from the raster name.
+
+        Parameters:
+        -----------
+        string : str
+            The raster name string.
+
+        Returns:
+        --------
+        str
+            The extracted date part.
+        """
+        match = re.search(r'MERGED-(.*?)-fv02', string)
+        if match:
+            return match.group(1)[:6]
+        return None
+
+    def zonalStatistic(self):
+        """
+        Calculates the mean of the raster for every grid cell and saves it to a CSV file.
+
+        The mapping of the grid cells to the raster pixels is taken from the weight cache, so all
+        rasters with the same georeferencing only rasterize the grid once. By default the pixels are
+        weighted by the share of their area covered by the cell, as the grid is not aligned to the
+        0.25 degree pixels of the sea level rasters.
+
+        Returns:
+        --------
+        str
+            The path of the CSV file, of the Parquet dataset with the output format 'parquet' or of the
+            NetCDF cube with the output format 'netcdf'.
+        """
+        features = list(self.grid.getFeatures())
+        engine = ZonalEngine(self.raster_layer.source(), [feature.geometry().asWkt() for feature in features],
+                             cache=WeightCache(os.path.join(self.output_folder, 'weight_cache')),
+                             name=self.shapefile_layer_name, mode=self.zonal_mode)
+        self.cells = [[feature['adm_0'], feature['Lat'], feature['Lon']] for feature in features]
+        self.means = engine.compute()['mean'][0]
+
+        if self.output_format == 'parquet':
+            return self.writeParquet()
+        if self.output_format == 'netcdf':
+            return self.writeCube()
+
+        new_folder_path = os.path.join(self.output_folder, 'individual_csv')
+        os.makedirs(new_folder_path, exist_ok=True)
+        output_csv_path = os.path.join(new_folder_path, f'{self.shapefile_layer_name}_{self.raster_name}.csv')
+
+        # Only the specified fields are written, cells without valid pixels get an empty mean
+        with openSink('csv', output_csv_path) as sink:
+            sink.write(dict(self.cellColumns(), **{f'{self.date}_mean': self.means}))
+
+        self.zonal_stats_results.append(output_csv_path)
+        print(f"Zonal statistic was successful for {self.raster_name}")
+        return output_csv_path
+
+    def cellColumns(self):
+        """
+        Returns the country, latitude and longitude of the grid cells as columns.
+
+        Returns:
+        --------
+        dict
+            The columns adm_0, Lat and Lon.
+        """
+        adm_0, lat, lon = zip(*self.cells) if self.cells else ([], [], [])
+        return {'adm_0': np.array(adm_0, dtype=object), 'Lat': np.array(lat, dtype=float), 'Lon': np.array(lon, dtype=float)}
+
+    def writeParquet(self):
+        """
+        Writes the mean of every grid cell to a Parquet dataset partitioned by country and date.
+
+        Returns:
+        --------
+        str
+            The folder of the Parquet dataset.
+        """
+        parquet_path = os.path.join(self.output_folder, 'zonal_statistic.parquet')
+        with openSink('parquet', parquet_path, {'date': self.date},
+                      partition_cols=['adm_0', 'date'], name=self.raster_name, value_columns=['mean']) as sink:
+            sink.write(dict(self.cellColumns(), mean=self.means))
+        print(f"Zonal statistic was successful for {self.raster_name}")
+        return parquet_path
+
+    def writeCube(self):
+        """
+        Appends the mean of every grid cell as one time step to the NetCDF cube of the grid.
+
+        Every grid gets its own cube (cube/<grid>.nc) with the dimensions (time, cell), the time of
+        the step is parsed from the raster name.
+
+        Returns:
+        --------
+        str
+            The path of the NetCDF file.
+        """
+        cells = self.cellColumns()
+        cube_path = appendToCube(os.path.join(self.output_folder, 'cube', f'{self.shapefile_layer_name}.nc'),
+                                 {'adm_0': cells['adm_0'], 'lat': cells['Lat'], 'lon': cells['Lon']},
+                                 parseDate(self.date or self.raster_name), self.means)
+        print(f"Zonal statistic was successful for {self.raster_name}")
+        return cube_path
+
+    def combine_csv_files(self):
+        return combineCSVFiles(self.output_folder)
+
+def combineCSVFiles(output_folder):
+    """
+    Combines the individual CSV files of the output folder into one CSV file.
+
+    Only files which are new since the last combination are read, see csvCombine.CSVCombiner.
+
+    Parameters:
+    -----------
+    output_folder : str
+        The folder containing the individual_csv folder.
+
+    Returns:
+    --------
+    str
+        The path of the combined CSV file.
+    """
+    combined_csv_path = combineFolder(os.path.join(output_folder, 'individual_csv'),
+                                      os.path.join(output_folder, 'combined_output.csv'))
+    print(f"Combined CSV file saved as {combined_csv_path}")
+    return combined_csv_path
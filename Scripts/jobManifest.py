@@ -0,0 +1,141 @@
+# Description: SQLite manifest of the finished jobs of a country x raster sweep. Every (country, raster)
+# job is recorded with a fingerprint of its inputs, its output and the number of rows it wrote, so a
+# rerun after a crash skips the finished jobs and only recomputes jobs whose inputs or output changed.
+
+import os
+import glob
+import time
+import hashlib
+import sqlite3
+from zonalOutput import storedRows
+
+
+def fingerprint(paths, **params):
+    """
+    Returns a fingerprint of input files and parameters.
+
+    Files are described by their size and modification time, including the files sharing their
+    base name (e.g. the .dbf and .prj of a shapefile).
+
+    Parameters:
+    -----------
+    paths : list of str
+        The input files.
+    **params
+        Further parameters which change the result, e.g. the output format.
+
+    Returns:
+    --------
+    str
+        The fingerprint.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        for file_path in sorted(set(glob.glob(glob.escape(os.path.splitext(path)[0]) + '.*')) | {path}):
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                digest.update(f'{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns};'.encode())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+class JobManifest:
+    """
+    A class to record finished (country, raster) jobs in a SQLite database.
+
+    A job is only recorded after its sink was closed, so its rows are committed. Jobs are the unit of
+    resuming, a job whose bands were only partly written is computed again as a whole.
+
+    Attributes:
+    -----------
+    path : str
+        The path of the database.
+    connection : sqlite3.Connection
+        The connection to the database.
+
+    Methods:
+    --------
+    __init__(self, path):
+        Opens or creates the manifest.
+
+    finishedOutput(self, country, raster, job_fingerprint):
+        Returns the output of a finished job if its fingerprint and its rows in the output still match.
+
+    record(self, country, raster, band_count, job_fingerprint, output, output_format='csv', rows=0):
+        Records a finished job.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                country TEXT NOT NULL,
+                raster TEXT NOT NULL,
+                band_count INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                output TEXT NOT NULL,
+                output_format TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                finished_at REAL NOT NULL,
+                PRIMARY KEY (country, raster)
+            )""")
+        self.connection.commit()
+
+    def finishedOutput(self, country, raster, job_fingerprint):
+        """
+        Returns the output of a finished job if its fingerprint and its rows in the output still match.
+
+        A CSV file belongs to the job alone, it only has to exist. The Parquet dataset and the SQLite
+        database are shared by all jobs, so the rows stored for the country and raster of the job are
+        counted and compared to the rows the job wrote.
+
+        Parameters:
+        -----------
+        country : str
+            The country of the job.
+        raster : str
+            The raster of the job.
+        job_fingerprint : str
+            The current fingerprint of the job inputs.
+
+        Returns:
+        --------
+        str or None
+            The output path, None if the job has to be (re)computed.
+        """
+        row = self.connection.execute(
+            "SELECT fingerprint, output, output_format, rows FROM jobs WHERE country = ? AND raster = ?",
+            (country, raster)).fetchone()
+        if row is None or row[0] != job_fingerprint:
+            return None
+        output, output_format, rows = row[1:]
+        if output_format == 'csv':
+            return output if os.path.exists(output) else None
+        stored = storedRows(output_format, output, {'country': country, 'raster': raster}, name=raster)
+        return output if stored == rows else None
+
+    def record(self, country, raster, band_count, job_fingerprint, output, output_format='csv', rows=0):
+        """
+        Records a finished job, replacing an earlier record of the job.
+
+        Parameters:
+        -----------
+        country : str
+            The country of the job.
+        raster : str
+            The raster of the job.
+        band_count : int
+            The number of bands of the raster.
+        job_fingerprint : str
+            The fingerprint of the job inputs.
+        output : str
+            The output path of the job.
+        output_format : str
+            The output format, 'csv', 'parquet' or 'sqlite'.
+        rows : int
+            The number of rows the job wrote.
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (country, raster, band_count, job_fingerprint, output, output_format, rows, time.time()))
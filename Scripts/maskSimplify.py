@@ -0,0 +1,211 @@
+# Description: Simplification of country masks before extraction and clipping. The boundaries are
+# simplified topology-preserving with a tolerance derived from the grid spacing or pixel size and snapped
+# to a precision grid, the simplified masks are cached per country in memory and on disk.
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from osgeo import ogr
+
+
+def toleranceForSpacing(spacing, fraction=0.1):
+    """
+    Returns the simplification tolerance for a grid spacing or pixel size.
+
+    Parameters:
+    -----------
+    spacing : float
+        The grid spacing or pixel size in map units.
+    fraction : float
+        The share of the spacing a boundary may move.
+
+    Returns:
+    --------
+    float
+        The tolerance in map units.
+    """
+    return abs(spacing) * fraction
+
+
+def simplifyGeometry(wkb, tolerance):
+    """
+    Simplifies a geometry topology-preserving and snaps it to a precision grid of a tenth of the tolerance.
+
+    Parameters:
+    -----------
+    wkb : bytes
+        The geometry as WKB.
+    tolerance : float
+        The simplification tolerance in map units.
+
+    Returns:
+    --------
+    bytes
+        The simplified geometry as WKB.
+    """
+    geometry = ogr.CreateGeometryFromWkb(bytes(wkb))
+    simplified = geometry.SimplifyPreserveTopology(tolerance)
+    # Snapping needs GDAL 3.9, older versions keep the coordinates
+    if hasattr(simplified, 'SetPrecision'):
+        simplified = simplified.SetPrecision(tolerance / 10)
+    if simplified is None or simplified.IsEmpty():
+        return bytes(wkb)
+    if not simplified.IsValid():
+        simplified = simplified.MakeValid()
+    return bytes(simplified.ExportToWkb())
+
+
+def readGeometries(path):
+    """
+    Reads the geometries of a vector file.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the vector file.
+
+    Returns:
+    --------
+    tuple
+        The geometries as list of WKB and the CRS as WKT.
+    """
+    source = ogr.Open(path)
+    if source is None:
+        raise ValueError(f"Vector file {path} could not be opened")
+    layer = source.GetLayer(0)
+    srs = layer.GetSpatialRef()
+    geometries = [bytes(feature.GetGeometryRef().ExportToWkb()) for feature in layer if feature.GetGeometryRef() is not None]
+    return geometries, srs.ExportToWkt() if srs else ''
+
+
+def mergeGeometries(geometries):
+    """
+    Merges polygon geometries into one multipolygon without dissolving them.
+
+    Parameters:
+    -----------
+    geometries : list of bytes
+        The geometries as WKB.
+
+    Returns:
+    --------
+    bytes
+        The multipolygon as WKB.
+    """
+    merged = ogr.Geometry(ogr.wkbMultiPolygon)
+    for wkb in geometries:
+        geometry = ogr.ForceToMultiPolygon(ogr.CreateGeometryFromWkb(bytes(wkb)))
+        for index in range(geometry.GetGeometryCount()):
+            merged.AddGeometry(geometry.GetGeometryRef(index))
+    return bytes(merged.ExportToWkb())
+
+
+class MaskCache:
+    """
+    A class to cache the simplified masks of countries in memory and optionally on disk. On disk every
+    mask is stored as an npz file with the concatenated WKB bytes and the offset of every geometry.
+
+    Attributes:
+    -----------
+    folder : str or None
+        The folder of the cache files, None to only cache in memory.
+    masks : dict
+        The simplified masks by cache key.
+
+    Methods:
+    --------
+    __init__(self, folder=None):
+        Initializes the cache.
+
+    simplified(self, name, geometries, tolerance):
+        Returns the simplified geometries of a country mask.
+
+    load(self, path):
+        Loads the geometries of a cache file.
+
+    save(self, path, geometries):
+        Saves geometries to a cache file.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.masks = {}
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def simplified(self, name, geometries, tolerance):
+        """
+        Returns the simplified geometries of a country mask, simplifying them only on the first request.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the country.
+        geometries : list of bytes
+            The geometries as WKB.
+        tolerance : float
+            The simplification tolerance in map units.
+
+        Returns:
+        --------
+        list of bytes
+            The simplified geometries as WKB, in the order of geometries.
+        """
+        digest = hashlib.sha256(repr(tolerance).encode())
+        for wkb in geometries:
+            digest.update(bytes(wkb))
+        key = f'{name}_{digest.hexdigest()[:32]}'
+        if key in self.masks:
+            return self.masks[key]
+
+        path = os.path.join(self.folder, f'{key}.npz') if self.folder else None
+        cached = self.load(path) if path else None
+        if cached is not None:
+            self.masks[key] = cached
+            return cached
+
+        self.masks[key] = [simplifyGeometry(wkb, tolerance) for wkb in geometries]
+        if path:
+            self.save(path, self.masks[key])
+        return self.masks[key]
+
+    def load(self, path):
+        """
+        Loads the geometries of a cache file.
+
+        Parameters:
+        -----------
+        path : str
+            The path of the cache file.
+
+        Returns:
+        --------
+        list of bytes or None
+            The geometries as WKB, None if the file does not exist or cannot be read.
+        """
+        try:
+            with np.load(path) as data:
+                wkb, offsets = data['wkb'], data['offsets']
+        except (OSError, ValueError, KeyError):
+            return None
+        return [wkb[start:end].tobytes() for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def save(self, path, geometries):
+        """
+        Saves geometries to a cache file.
+
+        Parameters:
+        -----------
+        path : str
+            The path of the cache file.
+        geometries : list of bytes
+            The geometries as WKB.
+        """
+        offsets = np.cumsum([0] + [len(wkb) for wkb in geometries], dtype=np.int64)
+        wkb = np.frombuffer(b''.join(geometries), dtype=np.uint8)
+        # Write to a temporary file first, parallel workers may save the same mask
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as outfile:
+            np.savez(outfile, wkb=wkb, offsets=offsets)
+        os.replace(temp_path, path)
@@ -0,0 +1,25 @@
+# Description: Shared helpers for the worker processes of the engines. The workers are started with the
+# spawn method, which also works inside the QGIS application and on Windows.
+
+import os
+import sys
+import multiprocessing
+
+
+def processContext():
+    """
+    Returns the spawn context for the worker processes.
+
+    Inside QGIS sys.executable is the QGIS application, the workers are started with the Python
+    interpreter of the QGIS installation instead.
+
+    Returns:
+    --------
+    multiprocessing.context.SpawnContext
+        The process context.
+    """
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        executable = 'python.exe' if os.name == 'nt' else os.path.join('bin', 'python3')
+        context.set_executable(os.path.join(sys.exec_prefix, executable))
+    return context
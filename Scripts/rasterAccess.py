@@ -0,0 +1,145 @@
+# Description: Lazy, windowed access to multi-band rasters such as CORDEX NetCDF files. The dataset is
+# only opened when it is needed, only the pixel window covering an extent is read and the bands are
+# streamed in chunks, so a small country never loads a whole file.
+
+import math
+import numpy as np
+from osgeo import gdal
+
+
+class RasterWindow:
+    """
+    A class for lazy, windowed band access to a raster or a NetCDF variable.
+
+    Attributes:
+    -----------
+    path : str
+        The GDAL readable path of the raster, for a NetCDF variable NETCDF:"<file>":<variable>.
+    variable : str or None
+        The NetCDF variable, None for a raster or a NetCDF file with a single variable.
+    dataset : gdal.Dataset or None
+        The dataset, None until it is opened.
+
+    Methods:
+    --------
+    __init__(self, path, variable=None):
+        Initializes the RasterWindow for a raster or a variable of a NetCDF file.
+
+    open(self):
+        Opens the dataset if it is not opened yet.
+
+    window(self, x_min, y_min, x_max, y_max):
+        Returns the pixel window covering an extent.
+
+    pixelWindow(self, pixels):
+        Returns the pixel window covering flat pixel indices.
+
+    iterBands(self, window=None, chunk_size=12):
+        Reads the bands of a window in chunks.
+    """
+
+    def __init__(self, path, variable=None):
+        self.path = path if variable is None else f'NETCDF:"{path}":{variable}'
+        self.variable = variable
+        self.dataset = None
+
+    def open(self):
+        """
+        Opens the dataset if it is not opened yet.
+
+        A NetCDF file with several variables has no bands, GDAL only lists the variables as
+        subdatasets. Its only variable is opened if it has one, otherwise the variable has to be given.
+
+        Returns:
+        --------
+        gdal.Dataset
+            The dataset.
+        """
+        if self.dataset is None:
+            dataset = gdal.Open(self.path)
+            if dataset is None:
+                raise ValueError(f"Raster {self.path} could not be opened")
+            subdatasets = [name for name, _ in dataset.GetSubDatasets()]
+            if dataset.RasterCount == 0 and len(subdatasets) == 1:
+                self.path = subdatasets[0]
+                self.variable = self.path.rsplit(':', 1)[-1]
+                dataset = gdal.Open(self.path)
+            elif dataset.RasterCount == 0 and subdatasets:
+                variables = [name.rsplit(':', 1)[-1] for name in subdatasets]
+                raise ValueError(f"Raster {self.path} has the variables {variables}, one of them has to be given")
+            self.dataset = dataset
+        return self.dataset
+
+    def window(self, x_min, y_min, x_max, y_max):
+        """
+        Returns the pixel window covering an extent, clipped to the raster.
+
+        Parameters:
+        -----------
+        x_min, y_min, x_max, y_max : float
+            The extent in the CRS of the raster.
+
+        Returns:
+        --------
+        tuple of int
+            The x offset, y offset, width and height of the window. Width and height are 0 if the
+            extent is outside of the raster.
+        """
+        dataset = self.open()
+        inverse = gdal.InvGeoTransform(dataset.GetGeoTransform())
+        columns = []
+        rows = []
+        for x, y in [(x_min, y_min), (x_min, y_max), (x_max, y_min), (x_max, y_max)]:
+            column, row = gdal.ApplyGeoTransform(inverse, x, y)
+            columns.append(column)
+            rows.append(row)
+        x_off = max(0, math.floor(min(columns)))
+        y_off = max(0, math.floor(min(rows)))
+        x_end = min(dataset.RasterXSize, math.ceil(max(columns)))
+        y_end = min(dataset.RasterYSize, math.ceil(max(rows)))
+        return x_off, y_off, max(0, x_end - x_off), max(0, y_end - y_off)
+
+    def pixelWindow(self, pixels):
+        """
+        Returns the pixel window covering flat pixel indices.
+
+        Parameters:
+        -----------
+        pixels : numpy.ndarray
+            Flat pixel indices of the full raster.
+
+        Returns:
+        --------
+        tuple of int
+            The x offset, y offset, width and height of the window.
+        """
+        if len(pixels) == 0:
+            return 0, 0, 0, 0
+        rows, columns = np.divmod(pixels, self.open().RasterXSize)
+        x_off, y_off = int(columns.min()), int(rows.min())
+        return x_off, y_off, int(columns.max()) - x_off + 1, int(rows.max()) - y_off + 1
+
+    def iterBands(self, window=None, chunk_size=12):
+        """
+        Reads the bands of a window in chunks.
+
+        Parameters:
+        -----------
+        window : tuple of int, optional
+            The x offset, y offset, width and height of the window, by default the whole raster.
+        chunk_size : int
+            The number of bands read at once.
+
+        Yields:
+        -------
+        tuple
+            The index of the first band of the chunk (starting at 0) and the values of the chunk
+            with shape (bands, height, width).
+        """
+        dataset = self.open()
+        if window is None:
+            window = (0, 0, dataset.RasterXSize, dataset.RasterYSize)
+        for first in range(0, dataset.RasterCount, chunk_size):
+            last = min(first + chunk_size, dataset.RasterCount)
+            yield first, np.stack([dataset.GetRasterBand(band + 1).ReadAsArray(*window)
+                                   for band in range(first, last)])
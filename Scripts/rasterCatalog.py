@@ -0,0 +1,449 @@
+# Description: Metadata-only scanning of raster archives. The headers of all files of a directory are read
+# in parallel (extent, CRS, resolution, bands, variables and CF time), in threads or, for NetCDF files
+# whose driver serializes all calls behind a global lock, in worker processes. No pixels are read and no
+# QGIS layers are created. Layers or RasterWindows are only opened for the entries a job requests.
+# The entries can be kept in a persistent SQLite catalog with an R-tree of their WGS84 extents, which
+# selects the rasters covering an extent or country between two dates.
+
+import os
+import re
+import glob
+import fnmatch
+import json
+import sqlite3
+import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from osgeo import gdal, ogr, osr
+from timeCube import parseDate
+from processPool import processContext
+
+# File extensions read by the netCDF driver, which does not run in parallel threads
+NETCDF_EXTENSIONS = ('.nc', '.nc4', '.cdf')
+
+# Fewer NetCDF files are scanned serially, starting worker interpreters (e.g. from QGIS) takes longer
+PROCESS_MIN_FILES = 64
+
+# Seconds per unit of CF time units
+TIME_UNITS = {'days': 86400, 'day': 86400, 'd': 86400, 'hours': 3600, 'hour': 3600, 'h': 3600,
+              'minutes': 60, 'minute': 60, 'seconds': 1, 'second': 1, 's': 1}
+
+
+def decodeTimes(values, units, calendar='standard'):
+    """
+    Decodes CF time values like '{0,31,59}' with units like 'days since 1950-01-01' to dates.
+
+    Non-standard calendars (e.g. '365_day' of CORDEX) are decoded with netCDF4 if it is installed.
+
+    Parameters:
+    -----------
+    values : list of float
+        The time values.
+    units : str
+        The CF time units.
+    calendar : str
+        The CF calendar.
+
+    Returns:
+    --------
+    list of str or None
+        The dates in ISO format, None if the units or calendar can not be decoded.
+    """
+    calendar = (calendar or 'standard').lower()
+    if calendar not in ('standard', 'gregorian', 'proleptic_gregorian'):
+        try:
+            import netCDF4
+        except ImportError:
+            return None
+        return [date.isoformat() for date in netCDF4.num2date(values, units, calendar)]
+
+    match = re.match(r'\s*(\w+)\s+since\s+(\d{1,4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{1,2}):?(\d{1,2})?)?', units or '')
+    if match is None or match.group(1).lower() not in TIME_UNITS:
+        return None
+    reference = datetime.datetime(*[int(part) for part in match.groups()[1:] if part is not None])
+    seconds = TIME_UNITS[match.group(1).lower()]
+    return [(reference + datetime.timedelta(seconds=value * seconds)).isoformat() for value in values]
+
+
+def describeDataset(dataset, path, source, variable=None):
+    """
+    Describes the georeferencing, bands and time axis of an opened dataset.
+
+    Parameters:
+    -----------
+    dataset : gdal.Dataset
+        The dataset, only its metadata is read.
+    path : str
+        The path of the file.
+    source : str
+        The GDAL readable source of the dataset, e.g. 'NETCDF:"file.nc":tas'.
+    variable : str, optional
+        The NetCDF variable of the dataset.
+
+    Returns:
+    --------
+    dict
+        The catalog entry with path, source, variable, x_min, y_min, x_max, y_max, crs, resolution_x,
+        resolution_y, width, height, bands, time_start, time_end and times.
+    """
+    origin_x, pixel_width, _, origin_y, _, pixel_height = dataset.GetGeoTransform()
+    x_bounds = sorted([origin_x, origin_x + pixel_width * dataset.RasterXSize])
+    y_bounds = sorted([origin_y, origin_y + pixel_height * dataset.RasterYSize])
+
+    metadata = dataset.GetMetadata() or {}
+    times = None
+    values = metadata.get('NETCDF_DIM_time_VALUES')
+    if values:
+        times = decodeTimes([float(value) for value in values.strip('{}').split(',') if value],
+                            metadata.get('time#units'), metadata.get('time#calendar'))
+    if not times:
+        # Files without a time axis are dated by their name, e.g. '...-MERGED-20150101-fv02.2.nc'
+        date = parseDate(os.path.basename(path))
+        times = [datetime.datetime(date.year, date.month, date.day).isoformat()] if date else []
+
+    return {
+        'path': path,
+        'source': source,
+        'variable': variable,
+        'x_min': x_bounds[0],
+        'y_min': y_bounds[0],
+        'x_max': x_bounds[1],
+        'y_max': y_bounds[1],
+        'crs': dataset.GetProjection(),
+        'resolution_x': abs(pixel_width),
+        'resolution_y': abs(pixel_height),
+        'width': dataset.RasterXSize,
+        'height': dataset.RasterYSize,
+        'bands': dataset.RasterCount,
+        'time_start': min(times) if times else None,
+        'time_end': max(times) if times else None,
+        'times': times,
+    }
+
+
+def scanFile(path):
+    """
+    Reads the metadata of a raster file and of each of its NetCDF variables.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the raster file.
+
+    Returns:
+    --------
+    list of dict
+        One catalog entry per variable, see describeDataset. Empty if the file can not be opened.
+    """
+    dataset = gdal.OpenEx(path, gdal.OF_RASTER | gdal.OF_READONLY)
+    if dataset is None:
+        print(f"Failed to scan {path}")
+        return []
+    subdatasets = dataset.GetMetadata('SUBDATASETS') or {}
+    sources = [value for key, value in sorted(subdatasets.items()) if key.endswith('_NAME')]
+    if not sources:
+        return [describeDataset(dataset, path, path)] if dataset.RasterCount else []
+
+    entries = []
+    for source in sources:
+        subdataset = gdal.Open(source)
+        if subdataset is None or not subdataset.RasterCount:
+            continue
+        entries.append(describeDataset(subdataset, path, source, source.rsplit(':', 1)[-1]))
+    return entries
+
+
+def scanFiles(paths, workers=None):
+    """
+    Reads the metadata of raster files in parallel.
+
+    NetCDF files are scanned in worker processes, as the netCDF driver serializes all calls of a
+    process, other files in threads. With a single worker, or fewer than PROCESS_MIN_FILES NetCDF
+    files, the files are scanned serially in this process.
+
+    Parameters:
+    -----------
+    paths : list of str
+        The paths of the raster files.
+    workers : int, optional
+        The number of processes, by default the number of CPUs, or threads, by default 4 per CPU
+        as the work is mostly waiting for the disk.
+
+    Returns:
+    --------
+    list of list of dict
+        The catalog entries of every file, see scanFile.
+    """
+    if not paths:
+        return []
+    netcdf = any(path.lower().endswith(NETCDF_EXTENSIONS) for path in paths)
+    if (workers is not None and workers <= 1) or len(paths) == 1 or (netcdf and len(paths) < PROCESS_MIN_FILES):
+        return [scanFile(path) for path in paths]
+    if netcdf:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, mp_context=processContext()) as executor:
+            return list(executor.map(scanFile, paths, chunksize=max(1, len(paths) // (4 * workers))))
+    with ThreadPoolExecutor(max_workers=workers or 4 * (os.cpu_count() or 1)) as executor:
+        return list(executor.map(scanFile, paths))
+
+
+def scanDirectory(directory, pattern='*.nc', workers=None):
+    """
+    Reads the metadata of all raster files of a directory in parallel, see scanFiles.
+
+    Parameters:
+    -----------
+    directory : str
+        The directory of the raster files.
+    pattern : str
+        The glob pattern of the raster files.
+    workers : int, optional
+        The number of worker processes or threads, see scanFiles.
+
+    Returns:
+    --------
+    list of dict
+        The catalog entries ordered by path, see describeDataset.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    return [entry for entries in scanFiles(paths, workers) for entry in entries]
+
+
+def layerName(entry):
+    """
+    Returns the layer name of a catalog entry, the file name followed by the variable if there is one.
+
+    Parameters:
+    -----------
+    entry : dict
+        The catalog entry.
+
+    Returns:
+    --------
+    str
+        The layer name.
+    """
+    name = os.path.basename(entry['path'])
+    return f"{name}:{entry['variable']}" if entry['variable'] else name
+
+
+def geographicBounds(x_min, y_min, x_max, y_max, crs):
+    """
+    Transforms bounds to longitude and latitude (EPSG:4326).
+
+    Parameters:
+    -----------
+    x_min, y_min, x_max, y_max : float
+        The bounds in the given CRS.
+    crs : str
+        The CRS as WKT, empty if the bounds are already geographic.
+
+    Returns:
+    --------
+    tuple of float
+        The longitude and latitude bounds as x_min, y_min, x_max, y_max.
+    """
+    if not crs:
+        return x_min, y_min, x_max, y_max
+    source = osr.SpatialReference(wkt=crs)
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+    if source.IsSame(target):
+        return x_min, y_min, x_max, y_max
+    source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(source, target).TransformBounds(x_min, y_min, x_max, y_max, 21)
+
+
+class RasterCatalog:
+    """
+    A class to keep catalog entries in a SQLite database with an R-tree index of their WGS84 extents.
+
+    Attributes:
+    -----------
+    path : str
+        The path of the database.
+    connection : sqlite3.Connection
+        The connection to the database.
+
+    Methods:
+    --------
+    __init__(self, path):
+        Opens or creates the catalog.
+
+    update(self, directory, pattern='*.nc', workers=None):
+        Scans the new and changed files of a directory and removes the entries of deleted files.
+
+    updateFiles(self, paths, workers=None, removed=()):
+        Scans the given files if they are new or changed.
+
+    query(self, x_min=-180, y_min=-90, x_max=180, y_max=90, start=None, end=None, variable=None):
+        Returns the entries intersecting an extent and a time range.
+
+    queryVector(self, vector_path, start=None, end=None, variable=None):
+        Returns the entries intersecting the extent of a vector file, e.g. a country, and a time range.
+    """
+
+    # Columns of the rasters table besides id, in the order of the catalog entries
+    COLUMNS = ('path', 'source', 'variable', 'x_min', 'y_min', 'x_max', 'y_max', 'crs', 'resolution_x',
+               'resolution_y', 'width', 'height', 'bands', 'time_start', 'time_end', 'times')
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS rasters (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    source TEXT NOT NULL UNIQUE,
+                    variable TEXT,
+                    x_min REAL, y_min REAL, x_max REAL, y_max REAL,
+                    crs TEXT,
+                    resolution_x REAL, resolution_y REAL,
+                    width INTEGER, height INTEGER, bands INTEGER,
+                    time_start TEXT, time_end TEXT, times TEXT,
+                    file_size INTEGER, file_mtime INTEGER
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS rasters_path ON rasters (path)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS rasters_time ON rasters (time_start, time_end)")
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS rasters_extent USING rtree(id, lon_min, lon_max, lat_min, lat_max)")
+
+    def update(self, directory, pattern='*.nc', workers=None):
+        """
+        Scans the new and changed files of a directory and removes the entries of deleted files.
+
+        Files are compared by their size and modification time, unchanged files are not opened.
+
+        Parameters:
+        -----------
+        directory : str
+            The directory of the raster files.
+        pattern : str
+            The glob pattern of the raster files.
+        workers : int, optional
+            The number of scanning processes or threads, see scanFiles.
+
+        Returns:
+        --------
+        int
+            The number of scanned files.
+        """
+        folder = os.path.abspath(directory)
+        paths = glob.glob(os.path.join(folder, pattern))
+        deleted = [row['path'] for row in self.connection.execute("SELECT DISTINCT path FROM rasters")
+                   if os.path.dirname(row['path']) == folder and fnmatch.fnmatch(os.path.basename(row['path']), pattern)
+                   and row['path'] not in paths]
+        return self.updateFiles(paths, workers, deleted)
+
+    def updateFiles(self, paths, workers=None, removed=()):
+        """
+        Scans the given files if they are new or changed, e.g. the rasters a job was started with.
+
+        Files are stored with their absolute path, so the catalog can be used from any working directory.
+
+        Parameters:
+        -----------
+        paths : list of str
+            The paths of the raster files.
+        workers : int, optional
+            The number of scanning processes or threads, see scanFiles.
+        removed : list of str
+            The absolute paths of deleted files whose entries are removed.
+
+        Returns:
+        --------
+        int
+            The number of scanned files.
+        """
+        stats = {os.path.abspath(path): os.stat(path) for path in paths}
+        known = {row['path']: (row['file_size'], row['file_mtime'])
+                 for row in self.connection.execute("SELECT DISTINCT path, file_size, file_mtime FROM rasters")
+                 if row['path'] in stats}
+        changed = sorted(path for path, stat in stats.items() if known.get(path) != (stat.st_size, stat.st_mtime_ns))
+        removed = list(removed) + [path for path in known if path in changed]
+
+        scanned = scanFiles(changed, workers)
+
+        with self.connection:
+            for path in removed:
+                self.connection.execute("DELETE FROM rasters_extent WHERE id IN (SELECT id FROM rasters WHERE path = ?)", (path,))
+                self.connection.execute("DELETE FROM rasters WHERE path = ?", (path,))
+            for path, entries in zip(changed, scanned):
+                for entry in entries:
+                    values = [json.dumps(entry[column]) if column == 'times' else entry[column] for column in self.COLUMNS]
+                    cursor = self.connection.execute(
+                        f"INSERT INTO rasters ({', '.join(self.COLUMNS)}, file_size, file_mtime) "
+                        f"VALUES ({', '.join('?' * (len(self.COLUMNS) + 2))})",
+                        values + [stats[path].st_size, stats[path].st_mtime_ns])
+                    lon_min, lat_min, lon_max, lat_max = geographicBounds(
+                        entry['x_min'], entry['y_min'], entry['x_max'], entry['y_max'], entry['crs'])
+                    self.connection.execute("INSERT INTO rasters_extent VALUES (?, ?, ?, ?, ?)",
+                                            (cursor.lastrowid, lon_min, lon_max, lat_min, lat_max))
+        print(f"{len(changed)} of {len(stats)} files were scanned, {len(removed)} files were replaced or removed")
+        return len(changed)
+
+    def query(self, x_min=-180, y_min=-90, x_max=180, y_max=90, start=None, end=None, variable=None):
+        """
+        Returns the entries intersecting an extent and a time range.
+
+        Parameters:
+        -----------
+        x_min, y_min, x_max, y_max : float
+            The extent in longitude and latitude.
+        start, end : str or datetime.date, optional
+            The time range, entries without a time axis are always returned.
+        variable : str, optional
+            The NetCDF variable of the entries.
+
+        Returns:
+        --------
+        list of dict
+            The catalog entries ordered by time and path.
+        """
+        conditions = ["e.lon_max >= ? AND e.lon_min <= ? AND e.lat_max >= ? AND e.lat_min <= ?"]
+        parameters = [x_min, x_max, y_min, y_max]
+        if start is not None:
+            conditions.append("(r.time_end IS NULL OR r.time_end >= ?)")
+            parameters.append(start.isoformat() if hasattr(start, 'isoformat') else str(start))
+        if end is not None:
+            # A date without a time includes the whole day
+            end = end.isoformat() if hasattr(end, 'isoformat') else str(end)
+            conditions.append("(r.time_start IS NULL OR r.time_start <= ?)")
+            parameters.append(end + 'T23:59:59' if len(end) == 10 else end)
+        if variable is not None:
+            conditions.append("r.variable = ?")
+            parameters.append(variable)
+
+        rows = self.connection.execute(
+            f"SELECT r.* FROM rasters_extent e JOIN rasters r ON r.id = e.id WHERE {' AND '.join(conditions)} "
+            f"ORDER BY r.time_start, r.path, r.source", parameters)
+        return [dict({column: row[column] for column in self.COLUMNS}, times=json.loads(row['times'])) for row in rows]
+
+    def queryVector(self, vector_path, start=None, end=None, variable=None):
+        """
+        Returns the entries intersecting the extent of a vector file, e.g. a country, and a time range.
+
+        Parameters:
+        -----------
+        vector_path : str
+            The path of the vector file.
+        start, end : str or datetime.date, optional
+            The time range.
+        variable : str, optional
+            The NetCDF variable of the entries.
+
+        Returns:
+        --------
+        list of dict
+            The catalog entries ordered by time and path.
+        """
+        source = ogr.Open(vector_path)
+        if source is None:
+            raise ValueError(f"Vector file {vector_path} could not be opened")
+        layer = source.GetLayer(0)
+        x_min, x_max, y_min, y_max = layer.GetExtent()
+        srs = layer.GetSpatialRef()
+        x_min, y_min, x_max, y_max = geographicBounds(x_min, y_min, x_max, y_max, srs.ExportToWkt() if srs else '')
+        return self.query(x_min, y_min, x_max, y_max, start, end, variable)
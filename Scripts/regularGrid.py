@@ -0,0 +1,196 @@
+# Description: Implicit regular rectangle grid. The grid is described by its origin, spacing and shape,
+# cells are only materialized as QGIS features if they intersect the country mask, instead of creating
+# every cell of the bounding box with native:creategrid and throwing most of them away afterwards.
+
+import math
+import itertools
+import numpy as np
+from osgeo import gdal, ogr
+
+
+class RegularGrid:
+    """
+    A class describing a regular rectangle grid by its origin, spacing and shape.
+
+    Cells are numbered row by row starting at the top left cell, the index of a cell is
+    row * columns + column.
+
+    Attributes:
+    -----------
+    x_min : float
+        The left edge of the grid.
+    y_max : float
+        The top edge of the grid.
+    spacing_x : float
+        The width of a cell.
+    spacing_y : float
+        The height of a cell.
+    columns : int
+        The number of columns.
+    rows : int
+        The number of rows.
+
+    Methods:
+    --------
+    __init__(self, x_min, y_max, spacing_x, spacing_y, columns, rows):
+        Initializes the grid.
+
+    fromExtent(cls, x_min, y_min, x_max, y_max, spacing_x, spacing_y=None, align_to=None):
+        Creates the grid covering an extent, optionally aligned to the pixel grid of a raster.
+
+    cellCount(self):
+        Returns the number of cells of the grid.
+
+    cellBounds(self, indices):
+        Returns the bounds of the given cells.
+
+    maskedCells(self, geometries):
+        Returns the indices of the cells which intersect the mask geometries.
+
+    toLayer(self, indices, crs='EPSG:4326', name='Grid'):
+        Materializes the given cells as a memory layer.
+    """
+
+    def __init__(self, x_min, y_max, spacing_x, spacing_y, columns, rows):
+        self.x_min = x_min
+        self.y_max = y_max
+        self.spacing_x = spacing_x
+        self.spacing_y = spacing_y
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def fromExtent(cls, x_min, y_min, x_max, y_max, spacing_x, spacing_y=None, align_to=None):
+        """
+        Creates the grid covering an extent.
+
+        Parameters:
+        -----------
+        x_min, y_min, x_max, y_max : float
+            The extent to cover.
+        spacing_x : float
+            The width of a cell.
+        spacing_y : float, optional
+            The height of a cell, by default the width.
+        align_to : tuple, optional
+            A GDAL geotransform. The grid lines are snapped so that they run through the origin of this raster.
+
+        Returns:
+        --------
+        RegularGrid
+            The grid.
+        """
+        spacing_y = spacing_y or spacing_x
+        if align_to is not None:
+            x_min = align_to[0] + math.floor((x_min - align_to[0]) / spacing_x) * spacing_x
+            y_max = align_to[3] + math.ceil((y_max - align_to[3]) / spacing_y) * spacing_y
+        columns = max(1, math.ceil((x_max - x_min) / spacing_x))
+        rows = max(1, math.ceil((y_max - y_min) / spacing_y))
+        return cls(x_min, y_max, spacing_x, spacing_y, columns, rows)
+
+    def cellCount(self):
+        """
+        Returns the number of cells of the grid.
+
+        Returns:
+        --------
+        int
+            The number of cells.
+        """
+        return self.columns * self.rows
+
+    def cellBounds(self, indices):
+        """
+        Returns the bounds of the given cells.
+
+        Parameters:
+        -----------
+        indices : numpy.ndarray
+            The cell indices.
+
+        Returns:
+        --------
+        tuple of numpy.ndarray
+            The left, top, right and bottom edges of the cells.
+        """
+        rows, columns = np.divmod(np.asarray(indices), self.columns)
+        left = self.x_min + columns * self.spacing_x
+        top = self.y_max - rows * self.spacing_y
+        return left, top, left + self.spacing_x, top - self.spacing_y
+
+    def maskedCells(self, geometries):
+        """
+        Returns the indices of the cells which intersect the mask geometries.
+
+        The mask is rasterized onto the grid with every touched cell burned in, so only cells with
+        contact to the mask are returned. No cell geometries are created for this.
+
+        Parameters:
+        -----------
+        geometries : list of bytes
+            The mask geometries as WKB, in the CRS of the grid.
+
+        Returns:
+        --------
+        numpy.ndarray
+            The sorted indices of the cells.
+        """
+        source = ogr.GetDriverByName('Memory').CreateDataSource('mask')
+        layer = source.CreateLayer('mask', None, ogr.wkbUnknown)
+        for wkb in geometries:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+            layer.CreateFeature(feature)
+
+        mask_ds = gdal.GetDriverByName('MEM').Create('', self.columns, self.rows, 1, gdal.GDT_Byte)
+        mask_ds.SetGeoTransform((self.x_min, self.spacing_x, 0, self.y_max, 0, -self.spacing_y))
+        gdal.RasterizeLayer(mask_ds, [1], layer, burn_values=[1], options=['ALL_TOUCHED=TRUE'])
+        return np.flatnonzero(mask_ds.GetRasterBand(1).ReadAsArray())
+
+    def toLayer(self, indices, crs='EPSG:4326', name='Grid', fields=(), columns=()):
+        """
+        Materializes the given cells as a memory layer with the fields of native:creategrid.
+
+        Further fields, e.g. the cell centers, are filled when the features are created, so they do
+        not have to be written to the layer afterwards.
+
+        Parameters:
+        -----------
+        indices : numpy.ndarray
+            The cell indices, they are used as id of the features.
+        crs : str
+            The CRS of the layer.
+        name : str
+            The name of the layer.
+        fields : list of QgsField, optional
+            Further fields appended to the fields of native:creategrid.
+        columns : list, optional
+            One sequence of values per further field, in the order of indices.
+
+        Returns:
+        --------
+        QgsVectorLayer
+            The grid layer.
+        """
+        from qgis.core import QgsVectorLayer, QgsField, QgsFeature, QgsGeometry, QgsRectangle
+        from PyQt5.QtCore import QVariant
+
+        grid = QgsVectorLayer(f'Polygon?crs={crs}', name, 'memory')
+        provider = grid.dataProvider()
+        provider.addAttributes([QgsField('id', QVariant.LongLong)] +
+                               [QgsField(field, QVariant.Double) for field in ['left', 'top', 'right', 'bottom']] +
+                               list(fields))
+        grid.updateFields()
+
+        features = []
+        left, top, right, bottom = self.cellBounds(indices)
+        columns = [column.tolist() if isinstance(column, np.ndarray) else list(column) for column in columns]
+        values = zip(*columns) if columns else itertools.repeat(())
+        for index, cell, extra in zip(np.asarray(indices).tolist(), zip(left.tolist(), top.tolist(), right.tolist(), bottom.tolist()), values):
+            feature = QgsFeature(grid.fields())
+            feature.setGeometry(QgsGeometry.fromRect(QgsRectangle(cell[0], cell[3], cell[2], cell[1])))
+            feature.setAttributes([index] + list(cell) + list(extra))
+            features.append(feature)
+        provider.addFeatures(features)
+        grid.updateExtents()
+        return grid
@@ -0,0 +1,228 @@
+# Description: Command line entry point for running the pipelines without an open QGIS project.
+# Inputs are given as directories or glob patterns, optionally through a JSON config file. QGIS is only
+# started inside the worker processes, so listing the jobs with --dry-run needs no QGIS installation.
+#
+# Usage (from the Scripts folder):
+#     python -m runPipeline zonal --countries "countries/*.shp" --rasters "cordex/*.nc" --output out
+#     python -m runPipeline sealevel --config sealevel.json --workers 16
+#     python -m runPipeline clip --masks dissolved --rasters erosion.tif --output clipped --format COG
+#     python -m runPipeline sealevel --grids grids --rasters sla --catalog sla.sqlite --start 2010-01-01 --output out
+
+import os
+import sys
+import glob
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import batchRunner
+
+# Input options of every command with the file pattern used if a directory is given, and the output formats
+COMMANDS = {
+    'zonal': ({'countries': '*.shp', 'rasters': '*.nc'}, ['csv', 'parquet', 'sqlite']),
+    'sealevel': ({'grids': '*.shp', 'rasters': '*.nc'}, ['csv', 'parquet', 'netcdf']),
+    'clip': ({'masks': '*.shp', 'rasters': '*.nc'}, ['netCDF', 'GTiff', 'COG', 'VRT']),
+}
+
+
+def expandInputs(patterns, default_pattern):
+    """
+    Expands directories and glob patterns to a sorted list of files.
+
+    Parameters:
+    -----------
+    patterns : list of str
+        Directories, glob patterns or file paths.
+    default_pattern : str
+        The pattern used for directories, e.g. '*.nc'.
+
+    Returns:
+    --------
+    list of str
+        The sorted file paths without duplicates.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, default_pattern)
+        paths.update(glob.glob(os.path.expanduser(pattern)))
+    return sorted(paths)
+
+
+def loadConfig(config_path):
+    """
+    Loads a JSON config file. Its keys are the long option names, e.g.
+    {"countries": ["data/countries"], "rasters": ["data/cordex/*.nc"], "output": "out", "workers": 16}.
+
+    Parameters:
+    -----------
+    config_path : str or None
+        The path of the config file.
+
+    Returns:
+    --------
+    dict
+        The config values, empty if no path is given.
+    """
+    if not config_path:
+        return {}
+    with open(config_path) as infile:
+        config = json.load(infile)
+    if not isinstance(config, dict):
+        raise ValueError(f"Config {config_path} has to contain a JSON object")
+    return config
+
+
+def selectRasters(catalog_path, vector_paths, raster_paths, start=None, end=None):
+    """
+    Selects the rasters covering any of the vector files within a time range from a raster catalog.
+
+    The catalog is updated with the given rasters first, only new and changed files are scanned.
+    Rasters which cannot be read are reported and left out.
+
+    Parameters:
+    -----------
+    catalog_path : str
+        The path of the catalog database.
+    vector_paths : list of str
+        The countries, grids or masks.
+    raster_paths : list of str
+        The candidate rasters.
+    start, end : str, optional
+        The time range as ISO dates.
+
+    Returns:
+    --------
+    list of str
+        The selected rasters in the order of raster_paths.
+    """
+    from rasterCatalog import RasterCatalog
+    catalog = RasterCatalog(catalog_path)
+    catalog.updateFiles(raster_paths)
+    cataloged = {row['path'] for row in catalog.connection.execute("SELECT DISTINCT path FROM rasters")}
+    for path in raster_paths:
+        if os.path.abspath(path) not in cataloged:
+            print(f"Raster {path} could not be read and is left out", file=sys.stderr)
+    selected = {entry['path'] for path in vector_paths for entry in catalog.queryVector(path, start, end)}
+    rasters = [path for path in raster_paths if os.path.abspath(path) in selected]
+    print(f"{len(rasters)} of {len(raster_paths)} rasters cover the inputs")
+    return rasters
+
+
+def parseArguments(argv=None):
+    """
+    Parses the command line arguments.
+
+    Parameters:
+    -----------
+    argv : list of str, optional
+        The arguments, by default sys.argv.
+
+    Returns:
+    --------
+    argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m runPipeline', description='Runs the zonal statistic pipelines headless.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, (inputs, formats) in COMMANDS.items():
+        subparser = subparsers.add_parser(command)
+        for name in inputs:
+            subparser.add_argument(f'--{name}', nargs='+', help=f'directories or glob patterns of the {name}')
+        subparser.add_argument('--output', help='the output folder')
+        subparser.add_argument('--config', help='a JSON config file, command line options take precedence')
+        subparser.add_argument('--workers', type=int, help='the number of workers, by default the number of CPUs')
+        subparser.add_argument('--format', choices=formats, help=f'the output format, {formats[0]} by default')
+        subparser.add_argument('--qgis-prefix', help='the QGIS installation, by default QGIS_PREFIX_PATH')
+        subparser.add_argument('--dry-run', action=argparse.BooleanOptionalAction, help='only list the jobs')
+        subparser.add_argument('--catalog', help='a raster catalog database, only rasters covering the inputs are used')
+        subparser.add_argument('--start', help='with --catalog, only rasters from this date on, e.g. 2000-01-01')
+        subparser.add_argument('--end', help='with --catalog, only rasters up to this date')
+        if command == 'clip':
+            subparser.add_argument('--simplify', action=argparse.BooleanOptionalAction,
+                                   help='simplify the masks with a tenth of the pixel size, off by default')
+        if command == 'zonal':
+            # Flags default to None, so values of the config file are only overridden if a flag is given
+            subparser.add_argument('--resume', action=argparse.BooleanOptionalAction,
+                                   help='skip jobs finished in an earlier run, on by default')
+            subparser.add_argument('--simplify', action=argparse.BooleanOptionalAction,
+                                   help='simplify the masks with a tenth of the grid spacing, on by default')
+            subparser.add_argument('--zonal-mode', choices=['coverage', 'center'], help='the pixel weighting, coverage by default')
+            subparser.add_argument('--statistics', nargs='+', help='the statistics, e.g. count sum mean p90, count sum mean by default')
+            subparser.add_argument('--reprojection', choices=['warp', 'transform'], help='how the raster is reprojected, warp by default')
+            subparser.add_argument('--grid-spacing', type=float, help='the grid spacing in degrees, 0.232 by default')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the selected pipeline.
+
+    Parameters:
+    -----------
+    argv : list of str, optional
+        The arguments, by default sys.argv.
+
+    Returns:
+    --------
+    int
+        The exit code.
+    """
+    args = parseArguments(argv)
+    config = loadConfig(args.config)
+
+    def option(name, default=None):
+        value = getattr(args, name.replace('-', '_'))
+        return value if value is not None else config.get(name.replace('-', '_'), default)
+
+    inputs = {}
+    inputs_patterns, formats = COMMANDS[args.command]
+    for name, default_pattern in inputs_patterns.items():
+        patterns = option(name, [])
+        inputs[name] = expandInputs([patterns] if isinstance(patterns, str) else patterns, default_pattern)
+        if not inputs[name]:
+            print(f"No {name} found", file=sys.stderr)
+            return 2
+    output_folder = option('output')
+    if not output_folder:
+        print("No output folder given", file=sys.stderr)
+        return 2
+    output_format = option('format', formats[0])
+    if output_format not in formats:
+        print(f"Output format {output_format} is not supported, use one of {', '.join(formats)}", file=sys.stderr)
+        return 2
+
+    first, rasters = [inputs[name] for name in inputs_patterns]
+    if option('catalog'):
+        rasters = selectRasters(option('catalog'), first, rasters, option('start'), option('end'))
+    print(f"{len(first) * len(rasters)} jobs: {len(first)} {list(inputs)[0]} x {len(rasters)} rasters")
+    if option('dry-run', False):
+        for path in first:
+            for raster_path in rasters:
+                print(f"{path} {raster_path}")
+        return 0
+
+    if option('qgis-prefix'):
+        os.environ['QGIS_PREFIX_PATH'] = option('qgis-prefix')
+    os.makedirs(output_folder, exist_ok=True)
+    if args.command == 'zonal':
+        # Only the given options are passed, the others keep the defaults of ProcessingTool
+        options = {name: option(name) for name in batchRunner.PROCESSING_OPTIONS if option(name) is not None}
+        batchRunner.runProcessingTools(first, rasters, output_folder, option('workers'), output_format,
+                                       resume=option('resume', True), options=options)
+    elif args.command == 'sealevel':
+        batchRunner.runGridCalculations(first, rasters, output_folder, option('workers'), output_format)
+    else:
+        # Clipping only needs GDAL, the masks are named after their files
+        from clipEngine import ClipEngine
+        from maskSimplify import MaskCache
+        mask_cache = MaskCache(os.path.join(output_folder, 'mask_cache'))
+        masks = {batchRunner.layerName(path): path for path in first}
+        for raster_path in rasters:
+            raster_folder = os.path.join(output_folder, batchRunner.layerName(raster_path)) if len(rasters) > 1 else output_folder
+            ClipEngine(raster_path, output_format, option('workers'), option('simplify', False), mask_cache).clipAll(masks, raster_folder)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+# Description: Per-stage instrumentation of the pipelines. Every stage is recorded as a span with its wall
+# time, CPU time, peak resident memory and counts like features and pixels, and written as one JSON line
+# to a metrics file. The metrics files of a sweep are summarized per stage at its end.
+
+import os
+import sys
+import json
+import time
+import ctypes
+import socket
+import functools
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def resetPeakMemory():
+    """
+    Resets the peak resident memory of the process, only supported on Linux.
+
+    Returns:
+    --------
+    bool
+        Whether the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as outfile:
+            outfile.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    """
+    The PROCESS_MEMORY_COUNTERS structure of the Windows API GetProcessMemoryInfo.
+    """
+    _fields_ = [('cb', ctypes.c_ulong),
+                ('PageFaultCount', ctypes.c_ulong),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)]
+
+
+def windowsPeakMemory():
+    """
+    Returns the peak working set of the process on Windows in MB.
+
+    Returns:
+    --------
+    float or None
+        The peak working set, None if it is not available.
+    """
+    try:
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = ctypes.c_void_p
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_ulong]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize / 1024 ** 2
+    except (AttributeError, OSError):
+        return None
+
+
+def peakMemory():
+    """
+    Returns the peak resident memory of the process in MB.
+
+    On Linux the peak since the last resetPeakMemory is read, on Windows the peak working set and
+    elsewhere the peak since the start of the process.
+
+    Returns:
+    --------
+    float or None
+        The peak memory, None if it is not available.
+    """
+    if sys.platform == 'win32':
+        return windowsPeakMemory()
+    try:
+        with open('/proc/self/status') as infile:
+            for line in infile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    return None
+
+
+class StageMetrics:
+    """
+    A class to record the stages of a job as spans and write them as JSON lines.
+
+    Attributes:
+    -----------
+    path : str or None
+        The path of the metrics file, None to only keep the spans in memory.
+    context : dict
+        Fields added to every span, e.g. the country and raster of the job.
+    spans : list of dict
+        The finished spans.
+    open_spans : list of dict
+        The spans which are running, the innermost last.
+
+    Methods:
+    --------
+    __init__(self, path=None, **context):
+        Initializes the recorder.
+
+    span(self, stage):
+        Returns a context manager recording a stage.
+
+    count(self, **counts):
+        Adds counts to the innermost running span.
+
+    write(self, span):
+        Appends a finished span to the metrics file.
+    """
+
+    def __init__(self, path=None, **context):
+        self.path = path
+        self.context = context
+        self.spans = []
+        self.open_spans = []
+
+    def span(self, stage):
+        """
+        Returns a context manager recording a stage.
+
+        Parameters:
+        -----------
+        stage : str
+            The name of the stage.
+
+        Returns:
+        --------
+        Span
+            The context manager, entering it returns the span record.
+        """
+        return Span(self, stage)
+
+    def count(self, **counts):
+        """
+        Adds counts to the innermost running span, e.g. count(features=120, pixels=40000).
+
+        Parameters:
+        -----------
+        **counts
+            The counts of the span.
+        """
+        if self.open_spans:
+            self.open_spans[-1].update(counts)
+
+    def write(self, span):
+        """
+        Appends a finished span to the metrics file as one JSON line.
+
+        Parameters:
+        -----------
+        span : dict
+            The span.
+        """
+        self.spans.append(span)
+        if self.path is None:
+            return
+        # One write per line, so parallel workers can append to the same file
+        with open(self.path, 'a') as outfile:
+            outfile.write(json.dumps(span, default=str) + '\n')
+
+
+class Span:
+    """
+    A context manager measuring one stage of a StageMetrics recorder.
+
+    Attributes:
+    -----------
+    metrics : StageMetrics
+        The recorder.
+    record : dict
+        The span with stage, context, start time and after the stage its measurements.
+    """
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.record = dict(metrics.context, stage=stage, host=socket.gethostname(), pid=os.getpid())
+
+    def __enter__(self):
+        self.peak_reset = resetPeakMemory()
+        self.peak_before = None if self.peak_reset else peakMemory()
+        self.record['start'] = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.metrics.open_spans.append(self.record)
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.open_spans.remove(self.record)
+        self.record['wall_seconds'] = round(time.perf_counter() - self.wall, 4)
+        self.record['cpu_seconds'] = round(time.process_time() - self.cpu, 4)
+        peak = peakMemory()
+        self.record['peak_rss_mb'] = round(peak, 1) if peak is not None else None
+        # Without a reset, e.g. on Windows, the peak belongs to the stage only if the stage raised it
+        raised = peak is not None and self.peak_before is not None and peak > self.peak_before
+        self.record['peak_rss_scope'] = 'stage' if self.peak_reset or raised else 'process'
+        self.record['status'] = 'ok' if exc_type is None else f'error: {exc_type.__name__}'
+        self.metrics.write(self.record)
+        return False
+
+
+def instrumented(stage):
+    """
+    Decorates a method so every call is recorded as a span of the StageMetrics in self.metrics.
+
+    Parameters:
+    -----------
+    stage : str
+        The name of the stage.
+
+    Returns:
+    --------
+    callable
+        The decorator.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def loadSpans(path, since=None):
+    """
+    Loads the spans of a metrics file.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the metrics file.
+    since : float, optional
+        Only spans starting at or after this time are loaded, e.g. the start of a sweep.
+
+    Returns:
+    --------
+    list of dict
+        The spans.
+    """
+    if not os.path.exists(path):
+        return []
+    spans = []
+    with open(path) as infile:
+        for line in infile:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or span.get('start', 0) >= since:
+                spans.append(span)
+    return spans
+
+
+def summarize(spans, key='country'):
+    """
+    Summarizes spans per stage and prints the summary.
+
+    For every stage the number of spans, total and mean wall time, total CPU time, the largest peak
+    memory and the slowest job (by the key field) are reported, the stages ordered by total wall time.
+
+    Parameters:
+    -----------
+    spans : list of dict
+        The spans, see loadSpans.
+    key : str
+        The field identifying a job in the summary of the slowest job.
+
+    Returns:
+    --------
+    list of dict
+        The summary of every stage.
+    """
+    stages = defaultdict(list)
+    for span in spans:
+        stages[span['stage']].append(span)
+
+    summary = []
+    for stage, stage_spans in stages.items():
+        walls = [span.get('wall_seconds', 0) for span in stage_spans]
+        peaks = [span['peak_rss_mb'] for span in stage_spans if span.get('peak_rss_mb') is not None]
+        slowest = max(stage_spans, key=lambda span: span.get('wall_seconds', 0))
+        summary.append({
+            'stage': stage,
+            'spans': len(stage_spans),
+            'errors': sum(1 for span in stage_spans if span.get('status', 'ok') != 'ok'),
+            'wall_seconds': round(sum(walls), 3),
+            'mean_wall_seconds': round(sum(walls) / len(walls), 3),
+            'cpu_seconds': round(sum(span.get('cpu_seconds', 0) for span in stage_spans), 3),
+            'max_peak_rss_mb': max(peaks) if peaks else None,
+            'slowest': slowest.get(key),
+            'slowest_wall_seconds': slowest.get('wall_seconds'),
+        })
+    summary.sort(key=lambda row: row['wall_seconds'], reverse=True)
+
+    total = sum(row['wall_seconds'] for row in summary) or 1
+    print(f"{'stage':<16} {'spans':>6} {'wall s':>10} {'share':>6} {'mean s':>8} {'cpu s':>10} {'peak MB':>8}  slowest")
+    for row in summary:
+        print(f"{row['stage']:<16} {row['spans']:>6} {row['wall_seconds']:>10.1f} {row['wall_seconds'] / total:>6.0%} "
+              f"{row['mean_wall_seconds']:>8.2f} {row['cpu_seconds']:>10.1f} {row['max_peak_rss_mb'] or 0:>8.0f}  "
+              f"{row['slowest']} ({row['slowest_wall_seconds']} s)")
+    return summary
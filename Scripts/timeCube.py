@@ -0,0 +1,182 @@
+# Description: Time series cube output for gridded zonal results. The values of all rasters of a grid are
+# stored in one NetCDF file with the dimensions (time, cell), where time is unlimited and every raster is
+# appended as one time step with the date parsed from its file name.
+
+import os
+import re
+import time
+import datetime
+import numpy as np
+
+# Units and calendar of the time coordinate
+TIME_UNITS = 'days since 1970-01-01 00:00:00'
+TIME_CALENDAR = 'standard'
+
+
+def parseDate(name):
+    """
+    Parses the date of a raster from its name, e.g. '...-MERGED-20150101-fv02.2', '...-20000115000000-fv02'
+    or '202301'.
+
+    The first 8 digits of a group of at least 8 digits are read as YYYYMMDD, so timestamps like
+    YYYYMMDDhhmmss are dated by their day. Otherwise a group of exactly 6 digits is read as YYYYMM,
+    months without a day are set to their first day.
+
+    Parameters:
+    -----------
+    name : str
+        The raster name or file name.
+
+    Returns:
+    --------
+    datetime.date or None
+        The date, None if the name contains no date.
+    """
+    for pattern in (r'(?<!\d)(\d{4})(\d{2})(\d{2})', r'(?<!\d)(\d{4})(\d{2})(?!\d)'):
+        for match in re.finditer(pattern, name):
+            parts = [int(part) for part in match.groups()] + [1]
+            try:
+                return datetime.date(parts[0], parts[1], parts[2])
+            except ValueError:
+                continue
+    return None
+
+
+class FileLock:
+    """
+    A lock file which serializes the writes of several processes to the same file.
+
+    Attributes:
+    -----------
+    path : str
+        The path of the lock file.
+    timeout : float
+        The number of seconds after which a lock is considered stale and removed.
+
+    Methods:
+    --------
+    __enter__(self):
+        Waits until the lock file can be created.
+
+    __exit__(self, exc_type, exc_value, traceback):
+        Removes the lock file.
+    """
+
+    def __init__(self, path, timeout=600):
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.timeout:
+                        os.remove(self.path)
+                except OSError:
+                    pass
+                time.sleep(0.05)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.remove(self.path)
+
+
+def appendToCube(path, cells, date, values, variable='mean'):
+    """
+    Appends the values of one raster as a time step to the cube of a grid.
+
+    The cube is created with the cell columns on the first call. If the date is already in the cube,
+    its time step is overwritten, so running the same raster again does not duplicate it. Otherwise
+    the time step is inserted at its sorted position, so the time coordinate stays monotonic when the
+    rasters of a grid finish out of order. The values are stored as compressed float32 in chunks of
+    12 time steps and up to 1024 cells.
+
+    Parameters:
+    -----------
+    path : str
+        The path of the NetCDF file.
+    cells : dict
+        The columns describing the cells, e.g. adm_0, lat and lon, as arrays of length cell_count.
+    date : datetime.date
+        The date of the raster.
+    values : numpy.ndarray
+        The value of every cell.
+    variable : str
+        The name of the value variable.
+
+    Returns:
+    --------
+    str
+        The path of the NetCDF file.
+    """
+    try:
+        import netCDF4
+    except ImportError:
+        raise ImportError("NetCDF output requires netCDF4, install it with 'pip install netCDF4'")
+    if date is None:
+        raise ValueError(f"No date given for {path}")
+
+    values = np.asarray(values, dtype=np.float32)
+    timestamp = netCDF4.date2num(datetime.datetime(date.year, date.month, date.day), TIME_UNITS, TIME_CALENDAR)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with FileLock(path + '.lock'):
+        with netCDF4.Dataset(path, 'a' if os.path.exists(path) else 'w') as dataset:
+            if 'time' not in dataset.variables:
+                dataset.Conventions = 'CF-1.8'
+                dataset.createDimension('cell', len(values))
+                dataset.createDimension('time', None)
+                time_variable = dataset.createVariable('time', 'f8', ('time',))
+                time_variable.units = TIME_UNITS
+                time_variable.calendar = TIME_CALENDAR
+                time_variable.standard_name = 'time'
+                for name, column in cells.items():
+                    column = np.asarray(column)
+                    cell_variable = dataset.createVariable(name, str if column.dtype.kind in 'OU' else column.dtype, ('cell',))
+                    if name.lower() in ('lat', 'latitude', 'lon', 'longitude'):
+                        cell_variable.standard_name = 'latitude' if name.lower().startswith('lat') else 'longitude'
+                        cell_variable.units = 'degrees_north' if name.lower().startswith('lat') else 'degrees_east'
+                    cell_variable[:] = column.astype(object) if column.dtype.kind in 'OU' else column
+                dataset.createVariable(variable, 'f4', ('time', 'cell'), zlib=True, fill_value=np.float32(np.nan),
+                                       chunksizes=(12, max(1, min(len(values), 1024))))
+            elif len(dataset.dimensions['cell']) != len(values):
+                raise ValueError(f"Cube {path} has {len(dataset.dimensions['cell'])} cells, got {len(values)} values")
+
+            times = np.asarray(dataset['time'][:])
+            existing = np.nonzero(times == timestamp)[0]
+            if len(existing):
+                index = int(existing[0])
+            else:
+                index = int(np.searchsorted(times, timestamp))
+                insertTimeStep(dataset, index)
+            dataset['time'][index] = timestamp
+            dataset[variable][index, :] = values
+    return path
+
+
+def insertTimeStep(dataset, index, block=12):
+    """
+    Inserts an empty time step at an index by shifting the later time steps of all time variables by one.
+
+    The time steps are shifted in blocks from the end, so only a block is held in memory.
+
+    Parameters:
+    -----------
+    dataset : netCDF4.Dataset
+        The cube, opened for writing.
+    index : int
+        The index of the new time step.
+    block : int
+        The number of time steps shifted at once.
+    """
+    count = len(dataset.dimensions['time'])
+    for variable in dataset.variables.values():
+        if not variable.dimensions or variable.dimensions[0] != 'time':
+            continue
+        for end in range(count, index, -block):
+            start = max(index, end - block)
+            variable[start + 1:end + 1] = variable[start:end]
+        if index < count and variable.name != 'time' and variable.dtype.kind == 'f':
+            # Variables not written by this call must not keep the value shifted away from the index
+            variable[index] = np.nan
@@ -0,0 +1,216 @@
+# Description: Windowed reprojection with an on-disk cache of the warped rasters. Only the window around a
+# country is warped, with all CPUs, onto a pixel grid aligned to a fixed target resolution. Warped windows
+# are reused by every later request whose window they contain, e.g. the same raster for another country
+# of the same region or the next run of the sweep.
+
+import os
+import math
+import hashlib
+import tempfile
+from osgeo import gdal, osr
+
+
+class WarpCache:
+    """
+    A class to reproject windows of rasters and cache the results as compressed GeoTIFFs, evicting the
+    least recently used files once the cache grows beyond its size limit.
+
+    The name of a cache file holds a hash of the source file, target CRS and resolution, followed by the
+    bounds of the window in pixels of the target grid.
+
+    Attributes:
+    -----------
+    folder : str
+        The folder of the cache files.
+    max_bytes : int
+        The maximum total size of the cache files.
+
+    Methods:
+    --------
+    __init__(self, folder, max_bytes=20 * 1024 ** 3):
+        Initializes the cache in the given folder.
+
+    prefix(self, source, target_crs, resolution):
+        Returns the file name prefix of a source, target CRS and resolution.
+
+    resolution(self, dataset, target_crs):
+        Returns the target resolution of a raster.
+
+    cached(self, prefix, window):
+        Returns a cache file containing a window.
+
+    warp(self, source, bounds, target_crs='EPSG:4326', resolution=None, margin=2):
+        Returns a raster of the source reprojected to the target CRS covering the bounds.
+
+    evict(self):
+        Removes the least recently used files until the cache fits its size limit.
+    """
+
+    def __init__(self, folder, max_bytes=20 * 1024 ** 3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+
+    def prefix(self, source, target_crs, resolution):
+        """
+        Returns the file name prefix of a source, target CRS and resolution.
+
+        Parameters:
+        -----------
+        source : str
+            The GDAL readable source of the raster.
+        target_crs : str
+            The target CRS, e.g. 'EPSG:4326'.
+        resolution : float
+            The target resolution.
+
+        Returns:
+        --------
+        str
+            The prefix of the cache file names.
+        """
+        path = source.split('"')[1] if source.startswith('NETCDF:') else source
+        stat = os.stat(path) if os.path.isfile(path) else None
+        description = (source, stat.st_size if stat else None, stat.st_mtime_ns if stat else None, target_crs, repr(resolution))
+        return 'warp_' + hashlib.sha256(repr(description).encode()).hexdigest()[:24]
+
+    def resolution(self, dataset, target_crs):
+        """
+        Returns the target resolution of a raster, the size of its pixels at its center in the target CRS.
+
+        Parameters:
+        -----------
+        dataset : gdal.Dataset
+            The raster.
+        target_crs : str
+            The target CRS.
+
+        Returns:
+        --------
+        float
+            The target resolution, rounded to 6 significant digits so it is stable between runs.
+        """
+        origin_x, pixel_width, _, origin_y, _, pixel_height = dataset.GetGeoTransform()
+        center_x = origin_x + pixel_width * dataset.RasterXSize / 2
+        center_y = origin_y + pixel_height * dataset.RasterYSize / 2
+        source_srs = osr.SpatialReference(wkt=dataset.GetProjection())
+        target_srs = osr.SpatialReference()
+        target_srs.SetFromUserInput(target_crs)
+        source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        x_min, y_min, x_max, y_max = osr.CoordinateTransformation(source_srs, target_srs).TransformBounds(
+            center_x, center_y + pixel_height, center_x + pixel_width, center_y, 21)
+        size = min(abs(x_max - x_min), abs(y_max - y_min))
+        return float(f'{size:.6g}')
+
+    def cached(self, prefix, window):
+        """
+        Returns a cache file containing a window and marks it as recently used.
+
+        Parameters:
+        -----------
+        prefix : str
+            The prefix of the cache file names.
+        window : tuple of int
+            The window as column_min, row_min, column_max, row_max of the target grid.
+
+        Returns:
+        --------
+        str or None
+            The path of the cache file, None if no file contains the window.
+        """
+        for file_name in sorted(os.listdir(self.folder)):
+            if not (file_name.startswith(prefix + '_') and file_name.endswith('.tif')):
+                continue
+            bounds = [int(value) for value in file_name[len(prefix) + 1:-4].split('_')]
+            if bounds[0] <= window[0] and bounds[1] <= window[1] and bounds[2] >= window[2] and bounds[3] >= window[3]:
+                path = os.path.join(self.folder, file_name)
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    continue
+                return path
+        return None
+
+    def warp(self, source, bounds, target_crs='EPSG:4326', resolution=None, margin=2):
+        """
+        Returns a raster of the source reprojected to the target CRS covering the bounds.
+
+        The bounds are extended by a margin and snapped outward to the pixels of the target grid, so
+        the windows of all countries share the same pixel grid. Only the source pixels needed for the
+        window are read and the warp runs on all CPUs.
+
+        Parameters:
+        -----------
+        source : str
+            The GDAL readable source of the raster.
+        bounds : tuple of float
+            The x_min, y_min, x_max and y_max of the window in the target CRS.
+        target_crs : str
+            The target CRS.
+        resolution : float, optional
+            The target resolution, by default the pixel size of the source in the target CRS.
+        margin : int
+            The number of pixels added around the bounds.
+
+        Returns:
+        --------
+        str
+            The path of the warped raster.
+        """
+        dataset = gdal.Open(source)
+        if dataset is None:
+            raise ValueError(f"Raster {source} could not be opened")
+        resolution = resolution or self.resolution(dataset, target_crs)
+        prefix = self.prefix(source, target_crs, resolution)
+        window = (math.floor(bounds[0] / resolution) - margin, math.floor(bounds[1] / resolution) - margin,
+                  math.ceil(bounds[2] / resolution) + margin, math.ceil(bounds[3] / resolution) + margin)
+
+        path = self.cached(prefix, window)
+        if path is not None:
+            print(f"Reusing the reprojected window {os.path.basename(path)}")
+            return path
+
+        path = os.path.join(self.folder, f"{prefix}_{'_'.join(str(value) for value in window)}.tif")
+        # Write to a temporary file first, parallel workers may warp the same window
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        os.close(handle)
+        result = gdal.Warp(temp_path, dataset,
+                           format='GTiff',
+                           dstSRS=target_crs,
+                           outputBounds=[value * resolution for value in window],
+                           xRes=resolution,
+                           yRes=resolution,
+                           resampleAlg='near',
+                           multithread=True,
+                           warpOptions=['NUM_THREADS=ALL_CPUS'],
+                           creationOptions=['COMPRESS=DEFLATE', 'TILED=YES', 'NUM_THREADS=ALL_CPUS'])
+        if result is None:
+            os.remove(temp_path)
+            raise RuntimeError(f"Reprojecting {source} failed")
+        result = None
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache fits its size limit.
+        """
+        files = []
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith('.tif'):
+                try:
+                    stat = os.stat(os.path.join(self.folder, file_name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_name))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,164 @@
+# Description: Persistent on-disk cache of the grid cell to raster pixel mapping. Rasters sharing the
+# georeferencing of an earlier raster reuse its mapping, so only the band values have to be read.
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+class WeightCache:
+    """
+    A class to store cell to pixel mappings as .npz files, evicting the least recently used files
+    once the cache grows beyond its size limit.
+
+    A mapping consists of the cell index and flat pixel index of every covered pixel, and optionally
+    a weight per pixel.
+
+    Attributes:
+    -----------
+    folder : str
+        The folder of the cache files.
+    max_bytes : int
+        The maximum total size of the cache files.
+
+    Methods:
+    --------
+    __init__(self, folder, max_bytes=2 * 1024 ** 3):
+        Initializes the cache in the given folder.
+
+    key(self, name, geometries, dataset, mode='center'):
+        Returns the cache key of a grid and the georeferencing of a raster.
+
+    path(self, key):
+        Returns the path of the cache file of a key.
+
+    load(self, key):
+        Loads a mapping from the cache.
+
+    save(self, key, cells, pixels, weights=None):
+        Saves a mapping to the cache.
+
+    evict(self):
+        Removes the least recently used files until the cache fits its size limit.
+    """
+
+    def __init__(self, folder, max_bytes=2 * 1024 ** 3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+
+    def key(self, name, geometries, dataset, mode='center'):
+        """
+        Returns the cache key of a grid and the georeferencing of a raster.
+
+        Parameters:
+        -----------
+        name : str
+            A readable prefix of the key, e.g. the country name.
+        geometries : list of str
+            The cell geometries as WKT.
+        dataset : gdal.Dataset
+            The raster.
+        mode : str
+            The way pixels are assigned to cells.
+
+        Returns:
+        --------
+        str
+            The cache key.
+        """
+        digest = hashlib.sha256()
+        for wkt in geometries:
+            digest.update(wkt.encode())
+            digest.update(b';')
+        digest.update(repr((dataset.GetGeoTransform(), dataset.RasterXSize, dataset.RasterYSize, mode)).encode())
+        digest.update(dataset.GetProjection().encode())
+        return f'{name}_{digest.hexdigest()[:32]}'
+
+    def path(self, key):
+        """
+        Returns the path of the cache file of a key.
+
+        Parameters:
+        -----------
+        key : str
+            The cache key.
+
+        Returns:
+        --------
+        str
+            The path of the .npz file.
+        """
+        return os.path.join(self.folder, f'{key}.npz')
+
+    def load(self, key):
+        """
+        Loads a mapping from the cache.
+
+        Parameters:
+        -----------
+        key : str
+            The cache key.
+
+        Returns:
+        --------
+        dict or None
+            The arrays 'cells', 'pixels' and optionally 'weights', None if the key is not cached.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                mapping = {name: data[name] for name in data.files}
+            # Mark the file as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return mapping
+
+    def save(self, key, cells, pixels, weights=None):
+        """
+        Saves a mapping to the cache.
+
+        Parameters:
+        -----------
+        key : str
+            The cache key.
+        cells : numpy.ndarray
+            The cell index of every covered pixel.
+        pixels : numpy.ndarray
+            The flat pixel index of every covered pixel.
+        weights : numpy.ndarray, optional
+            The weight of every covered pixel.
+        """
+        arrays = {'cells': cells, 'pixels': pixels}
+        if weights is not None:
+            arrays['weights'] = weights
+        # Write to a temporary file first, parallel workers may save the same key
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as outfile:
+            np.savez(outfile, **arrays)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache fits its size limit.
+        """
+        files = []
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.folder, file_name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_name))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,443 @@
+# Description: Vectorized zonal statistics for all bands of a raster. The grid cells are rasterized
+# onto the pixel grid of the raster once, afterwards count, sum, mean and optionally min, max, std and
+# percentiles are computed for every band in a single NumPy pass instead of one native:zonalstatisticsfb
+# run per band. In coverage mode every pixel is weighted by the fraction of its area covered by the
+# cell, like exactextract.
+
+import re
+import numpy as np
+from osgeo import gdal, ogr, osr
+from rasterAccess import RasterWindow
+
+# The statistics calculated if none are given
+STATISTICS = ('count', 'sum', 'mean')
+
+
+def validateStatistics(statistics):
+    """
+    Checks the names of statistics before any raster is read or output is written.
+
+    Parameters:
+    -----------
+    statistics : iterable of str
+        The statistics, any of 'count', 'sum', 'mean', 'min', 'max', 'std' and percentiles given as 'p'
+        followed by a percentage between 0 and 100, e.g. 'p50' or 'p2.5'.
+
+    Returns:
+    --------
+    tuple of str
+        The statistics.
+    """
+    statistics = tuple(statistics)
+    for statistic in statistics:
+        match = re.fullmatch(r'p(\d+(?:\.\d+)?)', statistic)
+        if statistic in ('count', 'sum', 'mean', 'min', 'max', 'std') or (match and float(match.group(1)) <= 100):
+            continue
+        raise ValueError(f"Statistic {statistic} is not supported")
+    return statistics
+
+
+def transformGeometries(geometries, source_crs, target_crs, segment_length=None):
+    """
+    Transforms cell geometries into another CRS, e.g. the rotated pole CRS of a CORDEX raster.
+
+    The edges are densified before the transformation, so cells stay close to their true shape
+    in CRSs where straight lines become curves.
+
+    Parameters:
+    -----------
+    geometries : list of str
+        The cell geometries as WKT.
+    source_crs : str
+        The CRS of the geometries, e.g. 'EPSG:4326' or WKT.
+    target_crs : str
+        The target CRS, e.g. the projection of the raster as WKT.
+    segment_length : float, optional
+        The maximum edge length in source units before the transformation, no densification if None.
+
+    Returns:
+    --------
+    list of str
+        The transformed geometries as WKT.
+    """
+    source_srs = osr.SpatialReference()
+    source_srs.SetFromUserInput(source_crs)
+    target_srs = osr.SpatialReference()
+    target_srs.SetFromUserInput(target_crs)
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+
+    transformed = []
+    for wkt in geometries:
+        geometry = ogr.CreateGeometryFromWkt(wkt)
+        if segment_length:
+            geometry.Segmentize(segment_length)
+        geometry.Transform(transform)
+        transformed.append(geometry.ExportToWkt())
+    return transformed
+
+
+class ZonalEngine:
+    """
+    A class to calculate zonal statistics of grid cells for every band of a raster at once.
+
+    In 'center' mode a pixel belongs to a cell if its center lies within the cell geometry, which is
+    the same rule native:zonalstatisticsfb uses. If cells overlap, a pixel is only assigned to one of
+    them. In 'coverage' mode every pixel overlapping a cell is weighted by the covered fraction of its
+    area, so cells which are not aligned to the pixels get exact area-weighted statistics without
+    supersampling. Only the pixel window covering the cells is read from the raster, in chunks of bands.
+
+    Attributes:
+    -----------
+    raster_path : str
+        The GDAL readable path of the raster.
+    mode : str
+        The way pixels are assigned to cells, 'center' or 'coverage'.
+    raster : RasterWindow
+        The windowed access to the raster.
+    dataset : gdal.Dataset
+        The opened raster dataset.
+    band_count : int
+        The number of bands of the raster.
+    cell_count : int
+        The number of grid cells.
+    cells : numpy.ndarray
+        The cell index of every pixel which lies within a cell.
+    pixels : numpy.ndarray
+        The flat pixel index belonging to each entry of cells.
+    weights : numpy.ndarray or None
+        The weight of each entry of cells, None if every pixel counts fully. In coverage mode the
+        covered fraction of the pixel.
+
+    Methods:
+    --------
+    __init__(self, raster_path, geometries, cache=None, name='cells', mode='center', variable=None):
+        Opens the raster (or a variable of a NetCDF file) and maps the pixels to the given cell geometries, using the cache if given.
+
+    rasterizeCells(self, geometries):
+        Rasterizes the cell geometries onto the pixel grid of the raster.
+
+    coverCells(self, geometries):
+        Calculates the fraction of every pixel covered by the cell geometries.
+
+    readBands(self, chunk_size=12):
+        Reads the values of the mapped pixels in chunks of bands.
+
+    iterStatistics(self, statistics=STATISTICS, chunk_size=12):
+        Calculates the statistics of every cell for one chunk of bands at a time.
+
+    percentile(self, bins, data, count, q):
+        Calculates a percentile of the values of every bin.
+
+    compute(self, statistics=STATISTICS, chunk_size=12):
+        Calculates the statistics of every cell for all bands.
+    """
+
+    def __init__(self, raster_path, geometries, cache=None, name='cells', mode='center', variable=None):
+        if mode not in ('center', 'coverage'):
+            raise ValueError(f"Mode {mode} is not supported")
+        self.raster_path = raster_path
+        self.mode = mode
+        self.raster = RasterWindow(raster_path, variable)
+        self.dataset = self.raster.open()
+        self.band_count = self.dataset.RasterCount
+        self.cell_count = len(geometries)
+        self.weights = None
+
+        # Rasters with the same georeferencing share the mapping of the cells to the pixels
+        mapping = None
+        if cache is not None:
+            key = cache.key(name, geometries, self.dataset, mode)
+            mapping = cache.load(key)
+        if mapping is None:
+            if mode == 'coverage':
+                self.cells, self.pixels, self.weights = self.coverCells(geometries)
+            else:
+                self.cells, self.pixels = self.rasterizeCells(geometries)
+            if cache is not None:
+                cache.save(key, self.cells, self.pixels, self.weights)
+        else:
+            self.cells, self.pixels = mapping['cells'], mapping['pixels']
+            self.weights = mapping.get('weights')
+
+    def rasterizeCells(self, geometries):
+        """
+        Rasterizes the cell geometries onto the pixel grid of the raster.
+
+        Only the window of the raster covering the cells is rasterized.
+
+        Parameters:
+        -----------
+        geometries : list of str
+            The cell geometries as WKT, in the CRS of the raster.
+
+        Returns:
+        --------
+        tuple of numpy.ndarray
+            The cell index and the flat pixel index of every pixel which lies within a cell.
+        """
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.dataset.GetProjection())
+        source = ogr.GetDriverByName('Memory').CreateDataSource('cells')
+        layer = source.CreateLayer('cells', srs, ogr.wkbUnknown)
+        layer.CreateField(ogr.FieldDefn('cell', ogr.OFTInteger))
+        for index, wkt in enumerate(geometries):
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField('cell', index)
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+            layer.CreateFeature(feature)
+
+        empty = np.zeros(0, dtype=np.int64)
+        if not geometries:
+            return empty, empty
+        x_min, x_max, y_min, y_max = layer.GetExtent()
+        x_off, y_off, width, height = self.raster.window(x_min, y_min, x_max, y_max)
+        if width == 0 or height == 0:
+            return empty, empty
+
+        geotransform = self.dataset.GetGeoTransform()
+        labels_ds = gdal.GetDriverByName('MEM').Create('', width, height, 1, gdal.GDT_Int32)
+        labels_ds.SetGeoTransform((
+            geotransform[0] + x_off * geotransform[1] + y_off * geotransform[2], geotransform[1], geotransform[2],
+            geotransform[3] + x_off * geotransform[4] + y_off * geotransform[5], geotransform[4], geotransform[5]
+        ))
+        labels_ds.SetProjection(self.dataset.GetProjection())
+        labels_band = labels_ds.GetRasterBand(1)
+        labels_band.Fill(-1)
+        gdal.RasterizeLayer(labels_ds, [1], layer, options=['ATTRIBUTE=cell'])
+
+        # Convert the window positions to flat pixel indices of the full raster
+        labels = labels_band.ReadAsArray()
+        rows, columns = np.nonzero(labels >= 0)
+        pixels = (rows + y_off).astype(np.int64) * self.dataset.RasterXSize + (columns + x_off)
+        return labels[rows, columns].astype(np.int64), pixels
+
+    def coverCells(self, geometries):
+        """
+        Calculates the fraction of every pixel covered by the cell geometries.
+
+        Cells which are axis-aligned rectangles, like the cells of a regular grid, are covered
+        analytically from the overlap of their bounds with the pixel bounds. For other geometries
+        every pixel of the cell envelope is intersected with the cell.
+
+        Parameters:
+        -----------
+        geometries : list of str
+            The cell geometries as WKT, in the CRS of the raster.
+
+        Returns:
+        --------
+        tuple of numpy.ndarray
+            The cell index, the flat pixel index and the covered fraction of every pixel overlapping a cell.
+        """
+        origin_x, pixel_width, rotation_x, origin_y, rotation_y, pixel_height = self.dataset.GetGeoTransform()
+        if rotation_x or rotation_y:
+            raise ValueError(f"Coverage of rotated raster {self.raster_path} is not supported")
+        width, height = self.dataset.RasterXSize, self.dataset.RasterYSize
+        pixel_area = abs(pixel_width * pixel_height)
+
+        cells, pixels, fractions = [], [], []
+        for index, wkt in enumerate(geometries):
+            geometry = ogr.CreateGeometryFromWkt(wkt)
+            if geometry is None or geometry.IsEmpty():
+                continue
+            x_min, x_max, y_min, y_max = geometry.GetEnvelope()
+            # Pixel positions of the envelope, pixel_height is negative for north-up rasters
+            column_bounds = np.clip(np.sort((np.array([x_min, x_max]) - origin_x) / pixel_width), 0, width)
+            row_bounds = np.clip(np.sort((np.array([y_min, y_max]) - origin_y) / pixel_height), 0, height)
+            columns = np.arange(int(np.floor(column_bounds[0])), int(np.ceil(column_bounds[1])))
+            rows = np.arange(int(np.floor(row_bounds[0])), int(np.ceil(row_bounds[1])))
+            if len(columns) == 0 or len(rows) == 0:
+                continue
+
+            envelope_area = (x_max - x_min) * (y_max - y_min)
+            if geometry.GetGeometryCount() == 1 and abs(geometry.GetArea() - envelope_area) <= 1e-9 * envelope_area:
+                # Overlap of the rectangle with each pixel column and row, as fraction of the pixel size
+                column_cover = (np.minimum(columns + 1, column_bounds[1]) - np.maximum(columns, column_bounds[0])).clip(0, 1)
+                row_cover = (np.minimum(rows + 1, row_bounds[1]) - np.maximum(rows, row_bounds[0])).clip(0, 1)
+                cover = np.outer(row_cover, column_cover)
+            else:
+                cover = np.zeros((len(rows), len(columns)))
+                for row_index, row in enumerate(rows):
+                    top = origin_y + row * pixel_height
+                    for column_index, column in enumerate(columns):
+                        left = origin_x + column * pixel_width
+                        ring = ogr.Geometry(ogr.wkbLinearRing)
+                        for x, y in ((left, top), (left + pixel_width, top), (left + pixel_width, top + pixel_height),
+                                     (left, top + pixel_height), (left, top)):
+                            ring.AddPoint_2D(x, y)
+                        pixel = ogr.Geometry(ogr.wkbPolygon)
+                        pixel.AddGeometry(ring)
+                        intersection = geometry.Intersection(pixel)
+                        if intersection is not None and not intersection.IsEmpty():
+                            cover[row_index, column_index] = intersection.GetArea() / pixel_area
+
+            row_index, column_index = np.nonzero(cover > 0)
+            cells.append(np.full(len(row_index), index, dtype=np.int64))
+            pixels.append(rows[row_index].astype(np.int64) * width + columns[column_index])
+            fractions.append(cover[row_index, column_index])
+
+        if not cells:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        return np.concatenate(cells), np.concatenate(pixels), np.concatenate(fractions)
+
+    def readBands(self, chunk_size=12):
+        """
+        Reads the values of the mapped pixels in chunks of bands.
+
+        Only the pixel window covering the mapped pixels is read. Scale and offset of the bands are
+        applied, nodata and NaN values are marked as invalid.
+
+        Parameters:
+        -----------
+        chunk_size : int
+            The number of bands read at once.
+
+        Yields:
+        -------
+        tuple
+            The index of the first band of the chunk (starting at 0), the values and the validity
+            mask, both of shape (bands, len(pixels)).
+        """
+        if len(self.pixels) == 0:
+            return
+        window = self.raster.pixelWindow(self.pixels)
+        rows, columns = np.divmod(self.pixels, self.dataset.RasterXSize)
+        local_pixels = (rows - window[1]) * window[2] + (columns - window[0])
+
+        for first, chunk in self.raster.iterBands(window, chunk_size):
+            values = chunk.reshape(len(chunk), -1)[:, local_pixels].astype(np.float64)
+            valid = ~np.isnan(values)
+            for offset in range(len(chunk)):
+                raster_band = self.dataset.GetRasterBand(first + offset + 1)
+                nodata = raster_band.GetNoDataValue()
+                if nodata is not None:
+                    valid[offset] &= values[offset] != nodata
+                values[offset] = values[offset] * (raster_band.GetScale() or 1.0) + (raster_band.GetOffset() or 0.0)
+            yield first, values, valid
+
+    def iterStatistics(self, statistics=STATISTICS, chunk_size=12):
+        """
+        Calculates the statistics of every cell for one chunk of bands at a time.
+
+        Count is the number of valid pixels overlapping the cell. If the pixels have weights, sum,
+        mean and std are weighted, while min, max and the percentiles use all overlapping pixels unweighted.
+        Percentiles are given as 'p' followed by the percentage, e.g. 'p50' for the median, and are
+        interpolated linearly between the pixel values.
+
+        Parameters:
+        -----------
+        statistics : tuple of str
+            The statistics to calculate, any of 'count', 'sum', 'mean', 'min', 'max', 'std' and percentiles.
+        chunk_size : int
+            The number of bands read at once.
+
+        Yields:
+        -------
+        tuple
+            The index of the first band of the chunk (starting at 0) and a dict with an array of shape
+            (bands, cell_count) for every statistic. For cells without valid pixels count and sum are 0,
+            like native:zonalstatisticsfb, and all other statistics are NaN.
+        """
+        statistics = validateStatistics(statistics)
+
+        if len(self.pixels) == 0:
+            for first in range(0, self.band_count, chunk_size):
+                bands = min(chunk_size, self.band_count - first)
+                yield first, {statistic: np.zeros((bands, self.cell_count), dtype=np.int64 if statistic == 'count' else float)
+                              if statistic in ('count', 'sum') else np.full((bands, self.cell_count), np.nan)
+                              for statistic in statistics}
+            return
+
+        for first, values, valid in self.readBands(chunk_size):
+            bands = len(values)
+            size = bands * self.cell_count
+            # One bincount over all bands of the chunk: band b of cell c is bin b * cell_count + c
+            bins = (np.arange(bands)[:, None] * self.cell_count + self.cells[None, :])[valid]
+            data = values[valid]
+            weights = np.ones(len(data)) if self.weights is None else np.broadcast_to(self.weights, values.shape)[valid]
+
+            count = np.bincount(bins, minlength=size)
+            weight_total = np.bincount(bins, weights=weights, minlength=size)
+            total = np.bincount(bins, weights=data * weights, minlength=size)
+            empty = weight_total <= 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(empty, np.nan, total / weight_total)
+
+            results = {}
+            for statistic in statistics:
+                if statistic == 'count':
+                    result = count
+                elif statistic == 'sum':
+                    result = total
+                elif statistic == 'mean':
+                    result = mean
+                elif statistic == 'std':
+                    squares = np.bincount(bins, weights=data * data * weights, minlength=size)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        result = np.where(empty, np.nan, np.sqrt(np.maximum(squares / weight_total - mean * mean, 0)))
+                elif statistic in ('min', 'max'):
+                    result = np.full(size, np.inf if statistic == 'min' else -np.inf)
+                    (np.minimum if statistic == 'min' else np.maximum).at(result, bins, data)
+                    result[count == 0] = np.nan
+                else:
+                    result = self.percentile(bins, data, count, float(statistic[1:]))
+                results[statistic] = result.reshape(bands, -1)
+            yield first, results
+
+    def percentile(self, bins, data, count, q):
+        """
+        Calculates a percentile of the values of every bin.
+
+        Parameters:
+        -----------
+        bins : numpy.ndarray
+            The bin of every value.
+        data : numpy.ndarray
+            The values.
+        count : numpy.ndarray
+            The number of values in every bin.
+        q : float
+            The percentile between 0 and 100.
+
+        Returns:
+        --------
+        numpy.ndarray
+            The percentile of every bin, NaN for empty bins.
+        """
+        if not 0 <= q <= 100:
+            raise ValueError(f"Percentile {q} is not between 0 and 100")
+        ordered = data[np.lexsort((data, bins))]
+        starts = np.cumsum(count) - count
+        result = np.full(len(count), np.nan)
+        filled = count > 0
+        position = starts[filled] + q / 100 * (count[filled] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        result[filled] = ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+        return result
+
+    def compute(self, statistics=STATISTICS, chunk_size=12):
+        """
+        Calculates the statistics of every cell for all bands, see iterStatistics.
+
+        Parameters:
+        -----------
+        statistics : tuple of str
+            The statistics to calculate.
+        chunk_size : int
+            The number of bands read at once.
+
+        Returns:
+        --------
+        dict
+            An array of shape (band_count, cell_count) for every statistic.
+        """
+        results = {statistic: [] for statistic in statistics}
+        for _, chunk in self.iterStatistics(statistics, chunk_size):
+            for statistic, values in chunk.items():
+                results[statistic].append(values)
+        return {statistic: np.concatenate(values) if values else np.zeros((0, self.cell_count))
+                for statistic, values in results.items()}
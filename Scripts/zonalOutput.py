@@ -0,0 +1,398 @@
+# Description: Output backends for zonal statistic results. The results are written straight from the
+# computed arrays, without writing a full CSV first and rewriting it afterwards. The sinks stream rows
+# to CSV, Parquet or SQLite with buffered bulk writes.
+
+import os
+import re
+import csv
+import sqlite3
+from urllib.parse import unquote
+import numpy as np
+
+
+def writeParquet(columns, root_path, partition_cols, name, value_columns=None):
+    """
+    Writes columns to a partitioned Parquet dataset.
+
+    The statistic columns are stored as float32, the coordinates keep their full precision, so
+    cells of fine grids stay distinct. Every call writes one file per partition named
+    after name, an existing file of the same name is replaced. ParquetSink deletes the files of an
+    earlier run of the same job first.
+
+    Parameters:
+    -----------
+    columns : dict
+        The column names and their values as arrays or lists of equal length.
+    root_path : str
+        The folder of the Parquet dataset.
+    partition_cols : list of str
+        The columns the dataset is partitioned by, e.g. ['country', 'month'].
+    name : str
+        The base name of the written files.
+    value_columns : list of str, optional
+        The columns stored as float32, by default the statistic columns (_count, _sum, _mean, ...).
+
+    Returns:
+    --------
+    str
+        The folder of the Parquet dataset.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow, install it with 'pip install pyarrow'")
+
+    arrays = {}
+    for column, values in columns.items():
+        values = np.asarray(values)
+        is_value = column in value_columns if value_columns is not None else column.startswith('_')
+        if is_value and values.dtype.kind == 'f':
+            values = values.astype(np.float32)
+        arrays[column] = pa.array(values)
+
+    os.makedirs(root_path, exist_ok=True)
+    pq.write_to_dataset(pa.table(arrays), root_path,
+                        partition_cols=partition_cols,
+                        basename_template=f'{name}-{{i}}.parquet',
+                        existing_data_behavior='overwrite_or_ignore')
+    return root_path
+
+
+def parquetFiles(root_path, constants, name):
+    """
+    Returns the files of a Parquet dataset written by ParquetSink under a name and constant partition values.
+
+    Parameters:
+    -----------
+    root_path : str
+        The folder of the Parquet dataset.
+    constants : dict
+        The constant columns of the sink, only partitions with these values are searched, e.g. country=AFG.
+    name : str
+        The base name of the files.
+
+    Returns:
+    --------
+    list of str
+        The paths of the files.
+    """
+    if not os.path.isdir(root_path):
+        return []
+    pattern = re.compile(re.escape(name) + r'-\d+-\d+\.parquet')
+    files = []
+    for folder, _, file_names in os.walk(root_path):
+        partitions = dict(part.split('=', 1) for part in os.path.relpath(folder, root_path).split(os.sep) if '=' in part)
+        if any(column in partitions and unquote(partitions[column]) != str(value) for column, value in constants.items()):
+            continue
+        files.extend(os.path.join(folder, file_name) for file_name in file_names if pattern.fullmatch(file_name))
+    return files
+
+
+def storedRows(output_format, path, constants, name=None, table='zonal_statistic'):
+    """
+    Counts the rows a sink stored under constant column values, e.g. the rows of one country and raster
+    in the shared Parquet dataset or SQLite database.
+
+    Parameters:
+    -----------
+    output_format : str
+        The output format, 'parquet' or 'sqlite'.
+    path : str
+        The path of the output.
+    constants : dict
+        The constant columns of the sink.
+    name : str, optional
+        The base name of the Parquet files.
+    table : str
+        The table of the SQLite database.
+
+    Returns:
+    --------
+    int or None
+        The number of rows, None if the output does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return sum(pq.ParquetFile(file_path).metadata.num_rows for file_path in parquetFiles(path, constants, name))
+    if output_format == 'sqlite':
+        connection = sqlite3.connect(path, timeout=60)
+        try:
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                return 0
+            condition = ' AND '.join(f'"{column}" = ?' for column in constants)
+            return connection.execute(f'SELECT COUNT(*) FROM "{table}" WHERE {condition}', list(constants.values())).fetchone()[0]
+        finally:
+            connection.close()
+    raise ValueError(f"Output format {output_format} is not supported")
+
+
+class TableSink:
+    """
+    A base class for streaming table outputs. Rows are buffered and written in bulk once the buffer
+    holds buffer_rows rows, so memory stays bounded however many bands and cells are written.
+
+    Attributes:
+    -----------
+    path : str
+        The path of the output.
+    constants : dict
+        Columns with one value for all rows, e.g. the country and raster, appended to every batch.
+    buffer_rows : int
+        The number of rows buffered before they are written.
+    buffer : list of dict
+        The buffered batches of columns.
+    buffered : int
+        The number of buffered rows.
+    rows : int
+        The number of rows written to the sink.
+
+    Methods:
+    --------
+    __init__(self, path, constants=None, buffer_rows=100000):
+        Initializes the sink.
+
+    write(self, columns):
+        Buffers a batch of rows given as columns.
+
+    flush(self):
+        Writes the buffered rows.
+
+    writeBatch(self, columns):
+        Writes a batch of rows to the output, implemented by the sinks.
+
+    close(self):
+        Writes the remaining rows and closes the output.
+    """
+
+    def __init__(self, path, constants=None, buffer_rows=100000):
+        self.path = path
+        self.constants = constants or {}
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        self.buffered = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, columns):
+        """
+        Buffers a batch of rows given as columns.
+
+        Parameters:
+        -----------
+        columns : dict
+            The column names and their values as arrays of equal length.
+        """
+        columns = {column: np.asarray(values) for column, values in columns.items()}
+        rows = len(next(iter(columns.values()))) if columns else 0
+        if rows == 0:
+            return
+        self.buffer.append(columns)
+        self.buffered += rows
+        self.rows += rows
+        if self.buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows with the constant columns appended.
+        """
+        if not self.buffer:
+            return
+        columns = {column: np.concatenate([batch[column] for batch in self.buffer]) for column in self.buffer[0]}
+        for column, value in self.constants.items():
+            columns[column] = np.full(self.buffered, value, dtype=object if isinstance(value, str) else None)
+        self.writeBatch(columns)
+        self.buffer = []
+        self.buffered = 0
+
+    def writeBatch(self, columns):
+        """
+        Writes a batch of rows to the output.
+
+        Parameters:
+        -----------
+        columns : dict
+            The column names and their values as arrays of equal length.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Writes the remaining rows and closes the output.
+        """
+        self.flush()
+
+
+class CSVSink(TableSink):
+    """
+    A sink writing the rows to a CSV file. NaN values are written as empty fields.
+
+    Attributes:
+    -----------
+    outfile : file
+        The opened CSV file.
+    writer : csv.writer
+        The CSV writer.
+    header : list of str or None
+        The column names, written with the first batch.
+    """
+
+    def __init__(self, path, constants=None, buffer_rows=100000):
+        super().__init__(path, constants, buffer_rows)
+        self.outfile = open(path, 'w', newline='')
+        self.writer = csv.writer(self.outfile)
+        self.header = None
+
+    def writeBatch(self, columns):
+        if self.header is None:
+            self.header = list(columns)
+            self.writer.writerow(self.header)
+        values = []
+        for column in self.header:
+            array = columns[column]
+            if array.dtype.kind == 'f':
+                array = np.where(np.isnan(array), None, array)
+            values.append(['' if value is None else value for value in array.tolist()])
+        self.writer.writerows(zip(*values))
+
+    def close(self):
+        super().close()
+        self.outfile.close()
+
+
+class ParquetSink(TableSink):
+    """
+    A sink writing the rows to a partitioned Parquet dataset, see writeParquet. Every batch is written
+    to its own file per partition, named after name and the number of the batch. The files written
+    earlier under the same name and constant partition values are deleted when the sink is opened,
+    so running the same job again replaces its rows, even if it writes fewer batches.
+
+    Attributes:
+    -----------
+    partition_cols : list of str
+        The columns the dataset is partitioned by.
+    name : str
+        The base name of the written files.
+    value_columns : list of str or None
+        The columns stored as float32, None for the statistic columns, see writeParquet.
+    batches : int
+        The number of written batches.
+
+    Methods:
+    --------
+    removeEarlierFiles(self):
+        Deletes the files written earlier under the same name and constant partition values.
+    """
+
+    def __init__(self, path, constants=None, buffer_rows=100000, partition_cols=(), name='part', value_columns=None):
+        super().__init__(path, constants, buffer_rows)
+        self.partition_cols = list(partition_cols)
+        self.name = name
+        self.value_columns = value_columns
+        self.batches = 0
+        self.removeEarlierFiles()
+
+    def removeEarlierFiles(self):
+        """
+        Deletes the files written earlier under the same name and constant partition values.
+
+        Returns:
+        --------
+        int
+            The number of deleted files.
+        """
+        files = parquetFiles(self.path, self.constants, self.name)
+        for file_path in files:
+            os.remove(file_path)
+        return len(files)
+
+    def writeBatch(self, columns):
+        writeParquet(columns, self.path, self.partition_cols, f'{self.name}-{self.batches}', self.value_columns)
+        self.batches += 1
+
+
+class SQLiteSink(TableSink):
+    """
+    A sink inserting the rows into a SQLite table. Rows written earlier with the same constant
+    columns are deleted first, so running the same job again replaces its rows.
+
+    Attributes:
+    -----------
+    table : str
+        The name of the table.
+    connection : sqlite3.Connection
+        The connection to the database.
+    created : bool
+        Whether the table exists.
+    """
+
+    def __init__(self, path, constants=None, buffer_rows=100000, table='zonal_statistic'):
+        super().__init__(path, constants, buffer_rows)
+        self.table = table
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.created = False
+        # The earlier rows are deleted right away, so a run without any rows replaces them as well
+        if self.constants:
+            with self.connection:
+                if self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                    condition = ' AND '.join(f'"{column}" = ?' for column in self.constants)
+                    self.connection.execute(f'DELETE FROM "{table}" WHERE {condition}', list(self.constants.values()))
+
+    def writeBatch(self, columns):
+        names = list(columns)
+        with self.connection:
+            if not self.created:
+                types = {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'INTEGER', 'f': 'REAL'}
+                definitions = ', '.join(f'"{column}" {types.get(columns[column].dtype.kind, "TEXT")}' for column in names)
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({definitions})')
+                self.created = True
+            values = []
+            for column in names:
+                array = columns[column]
+                if array.dtype.kind == 'f':
+                    array = np.where(np.isnan(array), None, array)
+                values.append(array.tolist())
+            quoted = ', '.join(f'"{column}"' for column in names)
+            placeholders = ', '.join('?' * len(names))
+            self.connection.executemany(f'INSERT INTO "{self.table}" ({quoted}) VALUES ({placeholders})', zip(*values))
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+# The sinks by output format
+SINKS = {'csv': CSVSink, 'parquet': ParquetSink, 'sqlite': SQLiteSink}
+
+
+def openSink(output_format, path, constants=None, **options):
+    """
+    Opens the sink of an output format.
+
+    Parameters:
+    -----------
+    output_format : str
+        The output format, one of SINKS.
+    path : str
+        The path of the output.
+    constants : dict, optional
+        Columns with one value for all rows.
+    **options
+        Further options of the sink, e.g. partition_cols and name of the ParquetSink.
+
+    Returns:
+    --------
+    TableSink
+        The opened sink.
+    """
+    if output_format not in SINKS:
+        raise ValueError(f"Output format {output_format} is not supported")
+    return SINKS[output_format](path, constants, **options)
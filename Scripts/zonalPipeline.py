@@ -0,0 +1,396 @@
+# Description: The ProcessingTool pipeline of processingTool.py (reprojection, grid, extraction and zonal
+# statistics for one country and raster). It is kept in its own module so the batch runner workers can
+# import it without running the example loop of the script.
+
+import os
+import sys
+from osgeo import gdal
+from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsVectorLayer, QgsField, QgsVectorFileWriter
+import processing
+import numpy as np
+from PyQt5.QtCore import QVariant
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from zonalEngine import ZonalEngine, STATISTICS, transformGeometries, validateStatistics
+from weightCache import WeightCache
+from zonalOutput import openSink, SINKS
+from regularGrid import RegularGrid
+from countryMask import CountryMask
+from maskSimplify import MaskCache, toleranceForSpacing
+from warpCache import WarpCache
+from stageMetrics import StageMetrics, instrumented
+
+# Folder path
+folder_path = f"C:/Users/nikolaus/Desktop/Script_testing/KfW_script/"
+
+class ProcessingTool:
+    """
+    A class to process geospatial data, including loading layers, reprojecting rasters, creating grids, 
+    performing intersections, extracting grids, calculating zonal statistics, and saving results to CSV.
+
+    Attributes:
+    -----------
+    country_name : str
+        The name of the country layer.
+    raster_name : str
+        The name of the raster layer.
+    output_folder : str
+        The folder where the CSV files are saved.
+    output_format : str
+        The format of the zonal statistic results, 'csv', 'parquet' or 'sqlite'.
+    project : QgsProject
+        The QGIS project instance.
+    country_layer : QgsVectorLayer
+        The loaded country vector layer.
+    raster_layer : QgsRasterLayer
+        The loaded raster layer.
+    grid : QgsVectorLayer
+        The created grid layer.
+    gridIntersect : QgsVectorLayer
+        The intersected grid layer.
+    gridExtract : QgsVectorLayer
+        The extracted grid layer.
+    zonal_stats_results : list
+        The path of the zonal statistic table.
+    band_count : int
+        The number of raster bands the zonal statistics were calculated for.
+    row_count : int
+        The number of rows written to the zonal statistic table.
+    parquet_path : str
+        The folder of the Parquet dataset if the output format is 'parquet'.
+    grid_spacing : float
+        The spacing of the grid cells in degrees.
+    mask_tolerance : float or None
+        The tolerance the country masks are simplified with, None to use the masks unchanged.
+    mask_cache : MaskCache
+        The cache of the simplified country masks.
+    reprojection : str
+        How rasters which are not in EPSG:4326 are handled, 'warp' reprojects the raster window and
+        'transform' transforms the grid cells into the CRS of the raster instead.
+    warp_cache : WarpCache
+        The cache of the reprojected raster windows.
+    zonal_mode : str
+        The way raster pixels are assigned to grid cells, 'coverage' (area-weighted) or 'center'.
+    statistics : tuple of str
+        The statistics calculated for every cell and band, see ZonalEngine.iterStatistics.
+    metrics : StageMetrics
+        The recorder of the stages, which appends a span per stage to metrics.jsonl in the output folder.
+
+    Methods:
+    --------
+    __init__(self, country_name, raster_name, output_folder=folder_path, output_format='csv', simplify=True, zonal_mode='coverage', statistics=STATISTICS, reprojection='warp', grid_spacing=0.232):
+        Initializes the ProcessingTool with the given country and raster names.
+
+    loadFile(self, layer_name):
+        Loads a layer by its name from the QGIS project.
+
+    rasterSource(self):
+        Returns the GDAL readable source of the raster layer.
+
+    countryMask(self):
+        Returns the CountryMask of the country layer with the simplified masks.
+
+    reproject(self):
+        Reprojects the raster layer to EPSG:4326 if it is not already in that CRS.
+
+    transformsGrid(self):
+        Returns whether the grid cells are transformed into the CRS of the raster.
+
+    createGrid(self):
+        Creates a grid over the extent of the country layer and adds longitude, latitude, and layer name attributes.
+
+    intersectGridToCountry(self):
+        Intersects the created grid with the country layer.
+
+    extractGrid(self):
+        Extracts the grid cells that intersect with the country layer.
+
+    zonalStatistic(self):
+        Calculates zonal statistics for all bands of the raster layer and streams them to one long-format table.
+
+    openSink(self):
+        Opens the sink the zonal statistic table is streamed to.
+
+    tableChunk(self, first, chunk, cells):
+        Returns the long-format table rows of a chunk of bands.
+
+    saveCSV(self):
+        Returns the path of the zonal statistic table.
+    """
+    
+    def __init__(self, country_name, raster_name, output_folder=folder_path, output_format='csv', simplify=True, zonal_mode='coverage',
+                 statistics=STATISTICS, reprojection='warp', grid_spacing=0.232):
+        if output_format not in SINKS:
+            raise ValueError(f"Output format {output_format} is not supported")
+        if reprojection not in ('warp', 'transform'):
+            raise ValueError(f"Reprojection {reprojection} is not supported")
+        # Checked before the sink is opened, which truncates an existing CSV file
+        statistics = validateStatistics(statistics)
+        self.project = QgsProject.instance()
+        self.country_name = country_name
+        self.raster_name = raster_name
+        self.output_folder = output_folder
+        self.output_format = output_format
+        self.country_layer = self.loadFile(self.country_name)
+        self.raster_layer = self.loadFile(self.raster_name)
+        self.grid = None
+        self.gridIntersect = None
+        self.gridExtract = None
+        self.zonal_stats_results = []
+        self.band_count = 0
+        self.row_count = 0
+        self.parquet_path = os.path.join(self.output_folder, 'zonal_statistic.parquet')
+        self.grid_spacing = grid_spacing
+        # Boundary details below a tenth of a grid cell do not change which cells touch the country
+        self.mask_tolerance = toleranceForSpacing(self.grid_spacing) if simplify else None
+        self.mask_cache = MaskCache(os.path.join(self.output_folder, 'mask_cache'))
+        self.reprojection = reprojection
+        self.warp_cache = WarpCache(os.path.join(self.output_folder, 'warp_cache'))
+        self.zonal_mode = zonal_mode
+        self.statistics = statistics
+        self.metrics = StageMetrics(os.path.join(self.output_folder, 'metrics.jsonl'),
+                                    country=self.country_name, raster=self.raster_name)
+        print(f"country_layer {self.country_layer}")
+        print(f"raster_layer {self.raster_layer}")
+
+    def loadFile(self, layer_name):
+        """
+        Loads a layer by its name from the QGIS project.
+
+        Parameters:
+        -----------
+        layer_name : str
+            The name of the layer to load.
+
+        Returns:
+        --------
+        QgsVectorLayer or QgsRasterLayer
+            The loaded layer.
+        """
+        layers = self.project.mapLayersByName(layer_name)
+        if not layers:
+            raise ValueError(f"Layer {layer_name} not found")
+        print(f"{layer_name} loaded")
+        return layers[0]
+
+    def rasterSource(self):
+        """
+        Returns the GDAL readable source of the raster layer.
+
+        Returns:
+        --------
+        str
+            The source of the raster layer, or the path of the reprojected raster.
+        """
+        return self.raster_layer if isinstance(self.raster_layer, str) else self.raster_layer.source()
+
+    @instrumented('reproject')
+    def reproject(self):
+        """
+        Reprojects the raster layer to EPSG:4326 if it is not already in that CRS.
+
+        Only the window around the country is warped, on all CPUs, and the warped windows are cached,
+        so the next country in the same region or the next run reuses them, see WarpCache.
+        """
+        if self.raster_layer.crs().authid() == 'EPSG:4326':
+            print(f"The {self.raster_layer.name()} has the right projection")
+        elif self.transformsGrid():
+            print(f"The {self.raster_layer.name()} is kept in its projection, the grid is transformed instead")
+        else:
+            print(f"The {self.raster_layer.name()} has not the right projection")
+            ext = self.country_layer.extent()
+            self.raster_layer = self.warp_cache.warp(self.raster_layer.source(),
+                                                     (ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()),
+                                                     'EPSG:4326')
+            self.metrics.count(warped=True)
+
+    def transformsGrid(self):
+        """
+        Returns whether the grid cells are transformed into the CRS of the raster instead of reprojecting it.
+
+        Transforming a few thousand cells is much cheaper than warping a multi-band raster and the
+        statistics are calculated from the original, unresampled pixels.
+
+        Returns:
+        --------
+        bool
+            True in 'transform' mode if the raster is not in EPSG:4326.
+        """
+        return (self.reprojection == 'transform' and not isinstance(self.raster_layer, str)
+                and self.raster_layer.crs().authid() != 'EPSG:4326')
+
+    def countryMask(self):
+        """
+        Returns the CountryMask of the country layer, simplified with the mask tolerance.
+
+        Returns:
+        --------
+        CountryMask
+            The country mask.
+        """
+        return CountryMask(self.country_layer, self.mask_tolerance, self.mask_cache)
+
+    @instrumented('createGrid')
+    def createGrid(self):
+        """
+        Creates a grid over the extent of the country layer and adds longitude, latitude, and layer name attributes.
+
+        The grid lines are snapped to run through the origin of the (reprojected) raster, so the grid is
+        the same for every country of a raster. Only the cells touching the country are created. The
+        cells are not aligned to the pixels, the 0.232 degree spacing is not a multiple of the pixel
+        size, the coverage mode of zonalStatistic weights the partially covered pixels.
+        """
+        ext = self.country_layer.extent()
+
+        # Create the grid through the raster origin, only cells touching the country are materialized
+        align_to = None if self.transformsGrid() else gdal.Open(self.rasterSource()).GetGeoTransform()
+        grid = RegularGrid.fromExtent(ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum(), self.grid_spacing,
+                                      align_to=align_to)
+        cells = grid.maskedCells(self.countryMask().geometries())
+        print(f"{len(cells)} of {grid.cellCount()} grid cells touch the country")
+        self.metrics.count(cells=len(cells), grid_cells=grid.cellCount())
+
+        # Add longitude, latitude, and layer name fields, the cells are rectangles so their centers are
+        # calculated from the cell bounds for all cells at once
+        left, top, right, bottom = grid.cellBounds(cells)
+        self.grid = grid.toLayer(cells, 'EPSG:4326', 'Grid', [
+            QgsField('longitude', QVariant.Double),
+            QgsField('latitude', QVariant.Double),
+            QgsField('layer_name', QVariant.String)
+        ], [(left + right) / 2, (top + bottom) / 2, [self.country_layer.name()] * len(cells)])
+
+        # Add the grid layer to the project
+        QgsProject.instance().addMapLayer(self.grid)
+        
+        print("Grid with longitude, latitude, and layer name attributes was created")
+
+
+    def intersectGridToCountry(self):
+        """
+        Intersects the created grid with the country layer.
+
+        Only grid cells on the boundary of the country are intersected, see CountryMask.
+        """
+        if not self.grid:
+            print("Grid not created")
+            return
+        self.gridIntersect = self.countryMask().intersect(self.grid, 'Intersection')
+        QgsProject.instance().addMapLayer(self.gridIntersect)
+        print("Intersection done")
+
+    @instrumented('extractGrid')
+    def extractGrid(self):
+        """
+        Extracts the grid cells that intersect with the country layer.
+
+        The cells are found with a spatial index and the prepared country geometry, see CountryMask.
+        """
+        if not self.grid:
+            print("Grid not created")
+            return
+        self.gridExtract = self.countryMask().extract(self.grid, 'Extracted')
+        self.metrics.count(features=self.gridExtract.featureCount())
+        QgsProject.instance().addMapLayer(self.gridExtract)
+        print("Extraction done")
+
+    @instrumented('zonalStatistic')
+    def zonalStatistic(self):
+        """
+        Calculates zonal statistics for all bands of the raster layer and streams them to one long-format table.
+
+        The statistics of all bands are calculated in one pass by the ZonalEngine, the grid cells are
+        only mapped to the raster pixels once and the mapping is cached for rasters with the same
+        georeferencing. In coverage mode the pixels are weighted by the covered share of their area, so
+        the 0.232 degree cells get exact means on rasters with other resolutions.
+
+        The table has one row per cell and month (band) with the columns cell_id, month, latitude,
+        longitude and one column per statistic, e.g. _count, _sum and _mean. The rows of every chunk
+        of bands are streamed to the sink of the output format as soon as they are calculated, see openSink,
+        so the metrics of this stage include the time spent writing the output.
+        """
+        features = list(self.gridExtract.getFeatures())
+        geometries = [feature.geometry().asWkt() for feature in features]
+        if self.transformsGrid():
+            # The cells are densified to an eighth of the spacing, their edges become curves in e.g. rotated pole CRSs
+            geometries = transformGeometries(geometries, 'EPSG:4326', gdal.Open(self.rasterSource()).GetProjection(),
+                                             self.grid_spacing / 8)
+        engine = ZonalEngine(self.rasterSource(), geometries,
+                             cache=WeightCache(os.path.join(self.output_folder, 'weight_cache')),
+                             name=self.country_name, mode=self.zonal_mode)
+        self.band_count = engine.band_count
+        self.metrics.count(features=len(features), bands=engine.band_count, pixels=len(engine.pixels) * engine.band_count)
+        cells = {
+            'cell_id': np.array([feature['id'] for feature in features]),
+            'latitude': np.array([feature['latitude'] for feature in features], dtype=float),
+            'longitude': np.array([feature['longitude'] for feature in features], dtype=float)
+        }
+
+        with self.openSink() as sink:
+            for first, chunk in engine.iterStatistics(self.statistics):
+                sink.write(self.tableChunk(first, chunk, cells))
+        self.zonal_stats_results = [sink.path]
+        self.row_count = sink.rows
+        print(f"Zonal statistic was successful for {engine.band_count} bands, saved at {sink.path}")
+
+    def openSink(self):
+        """
+        Opens the sink the zonal statistic table is streamed to.
+
+        CSV files are written per country and raster. The Parquet dataset and the SQLite database are
+        shared by all jobs of the output folder and get the country and raster as columns.
+
+        Returns:
+        --------
+        TableSink
+            The opened sink, see zonalOutput.
+        """
+        constants = {'country': self.country_name, 'raster': self.raster_name}
+        if self.output_format == 'parquet':
+            return openSink('parquet', self.parquet_path, constants, partition_cols=['country', 'month'], name=self.raster_name)
+        if self.output_format == 'sqlite':
+            return openSink('sqlite', os.path.join(self.output_folder, 'zonal_statistic.sqlite'), constants)
+        return openSink('csv', os.path.join(self.output_folder, f'{self.country_name}_FROM_{self.raster_name}.csv'))
+
+    def tableChunk(self, first, chunk, cells):
+        """
+        Returns the long-format table rows of a chunk of bands.
+
+        Parameters:
+        -----------
+        first : int
+            The index of the first band of the chunk (starting at 0).
+        chunk : dict
+            The statistics of the chunk as arrays of shape (bands, cell_count).
+        cells : dict
+            The cell_id, latitude and longitude of the cells.
+
+        Returns:
+        --------
+        dict
+            The columns cell_id, month, latitude, longitude and _<statistic> as arrays of equal length.
+        """
+        bands = len(next(iter(chunk.values())))
+        columns = {
+            'cell_id': np.tile(cells['cell_id'], bands),
+            'month': np.repeat(np.arange(first + 1, first + bands + 1), len(cells['cell_id'])),
+            'latitude': np.tile(cells['latitude'], bands),
+            'longitude': np.tile(cells['longitude'], bands)
+        }
+        for statistic, values in chunk.items():
+            columns[f'_{statistic}'] = values.ravel()
+        return columns
+
+    def saveCSV(self):
+        """
+        Returns the path of the zonal statistic table.
+
+        The table is already streamed by zonalStatistic, no intermediate files are combined or read again.
+
+        Returns:
+        --------
+        str
+            The path of the CSV file, the Parquet dataset or the SQLite database.
+        """
+        output_path = self.zonal_stats_results[0]
+        print(f"Zonal statistic was saved at {output_path}")
+        return output_path